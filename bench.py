@@ -0,0 +1,808 @@
+import os
+import sys
+import json
+import time
+import gc
+import random
+import tracemalloc
+import string
+import tempfile
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from aiohttp import web
+
+# keep the benchmarks away from the real database and json files
+BENCH_DIR = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_FILE", os.path.join(BENCH_DIR, "bench.db"))
+for name, filename in (("FLIGHTS_FILE", "flights.json"), ("BOOKINGS_FILE", "bookings.json"),
+                       ("META_FILE", "meta.json"), ("ARCHIVE_FILE", "archived_flights.json")):
+    os.environ.setdefault(name, os.path.join(BENCH_DIR, filename))
+
+import bot
+
+
+def fake_booking_dicts(total, flights=200):
+    # the json / pre-Booking shape
+    bookings = {}
+    for i in range(total):
+        flight_code = f"AK{i % flights:04d}"
+        bookings.setdefault(flight_code, []).append({
+            "booking_code": f"AK{i:05d}-{''.join(random.choices(string.ascii_uppercase, k=6))}",
+            "roblox_username": f"passenger_{i}",
+            "discord_id": 100000000000000000 + i % 5000,
+            "cabin_class": random.choice(["Economy", "Premium Economy", "Business", "First Class"]),
+            "booked_at": datetime(2024, 1, 1, 0, 0, i % 60, i % 7 * 1000).isoformat()
+        })
+    return bookings
+
+
+def fake_bookings(total, flights=200):
+    return {code: [bot.Booking.from_dict(b) for b in passengers]
+            for code, passengers in fake_booking_dicts(total, flights).items()}
+
+
+def bench_index(total=100_000, lookups=100_000):
+    bookings = fake_bookings(total)
+    codes = [b.booking_code for passengers in bookings.values() for b in passengers]
+    users = [b.discord_id for passengers in bookings.values() for b in passengers]
+
+    index = bot.BookingIndex()
+    started = time.perf_counter()
+    index.rebuild(bookings)
+    print(f"index rebuild: {total} bookings in {time.perf_counter() - started:.3f}s")
+
+    sample = random.choices(codes, k=lookups)
+    started = time.perf_counter()
+    for code in sample:
+        index.get(code)
+    elapsed = time.perf_counter() - started
+    print(f"by booking code: {elapsed / lookups * 1e9:.0f} ns/lookup")
+
+    sample = random.choices(users, k=lookups)
+    started = time.perf_counter()
+    for discord_id in sample:
+        index.for_user(discord_id)
+    elapsed = time.perf_counter() - started
+    print(f"by discord id: {elapsed / lookups * 1e9:.0f} ns/lookup")
+
+    started = time.perf_counter()
+    for i in range(lookups):
+        index.passenger_booked(f"AK{i % 200:04d}", f"passenger_{i}")
+    elapsed = time.perf_counter() - started
+    print(f"by passenger: {elapsed / lookups * 1e9:.0f} ns/lookup")
+
+    # what the same lookup cost before the index
+    sample = random.choices(codes, k=100)
+    started = time.perf_counter()
+    for code in sample:
+        next(b for passengers in bookings.values() for b in passengers if b.booking_code == code)
+    elapsed = time.perf_counter() - started
+    print(f"linear scan by booking code: {elapsed / len(sample) * 1e9:.0f} ns/lookup")
+
+
+def traced_bytes(build):
+    # memory still held by whatever build() returns, strings included
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, size
+
+
+def bench_memory(total=100_000):
+    dicts, dict_bytes = traced_bytes(lambda: fake_booking_dicts(total))
+    as_json = json.dumps(dicts)
+
+    bookings, booking_bytes = traced_bytes(lambda: {
+        code: [bot.Booking.from_dict(b) for b in passengers]
+        for code, passengers in json.loads(as_json).items()
+    })
+    assert json.dumps({code: [b.to_dict() for b in passengers] for code, passengers in bookings.items()}) == as_json, \
+        "json round trip changed the bookings"
+
+    index = bot.BookingIndex()
+    _, index_bytes = traced_bytes(lambda: index.rebuild(bookings))
+
+    print(f"memory: {total} bookings")
+    print(f"  dicts:    {dict_bytes / total:6.0f} bytes/booking")
+    print(f"  Booking:  {booking_bytes / total:6.0f} bytes/booking ({booking_bytes / dict_bytes:.0%}), json round trip identical")
+    print(f"  index on top: {index_bytes / total:6.0f} bytes/booking")
+
+
+def bench_codes(total=2_000_000):
+    generator = bot.BookingCodeGenerator()
+    started = time.perf_counter()
+    codes = [generator.generate() for _ in range(total)]
+    elapsed = time.perf_counter() - started
+
+    assert len(set(codes)) == total, "duplicate booking code"
+    assert all(len(code) == 14 and code[:2] == "AK" and code[7] == "-" for code in codes)
+    print(f"booking codes: {total} unique in {elapsed:.2f}s ({total / elapsed:,.0f}/s)")
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        self.channel.edits += 1
+
+    async def pin(self):
+        pass
+
+
+class FakeChannel:
+    # stands in for a discord text channel, counts what the board sends
+    def __init__(self):
+        self.sends = 0
+        self.edits = 0
+
+    async def send(self, **kwargs):
+        self.sends += 1
+        return FakeMessage(self, 1000 + self.sends)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+
+def loaded_client():
+    # the bot loads its stores from setup_hook, which only runs once it logs in
+    if bot.client.store is None:
+        bot.client.load_state()
+        bot.client.loaded.set()
+    return bot.client
+
+
+def add_fake_flight(flight_code, spots, departure="2099-01-01 10:00"):
+    loaded_client().flights[flight_code] = {
+        "route": "HEATHROW → KOSICE",
+        "aircraft": "Airbus A320-271N",
+        "spots_left": spots,
+        "capacity": spots,
+        "departure": departure,
+        "timezone": "Europe/London"
+    }
+    bot.client.save_flight(flight_code)
+
+
+async def run_board(bookings=200):
+    client = loaded_client()
+    channel = FakeChannel()
+
+    async def get_channel(channel_id):
+        return channel
+
+    board = bot.DepartureBoard(client, [1], get_channel=get_channel, debounce=0.2, min_interval=0.1, refresh=3600)
+    client.flight_listeners.append(board.mark_dirty)
+    add_fake_flight("AKBOARD", bookings)
+
+    task = asyncio.create_task(board.run())
+    await asyncio.sleep(0.05)
+
+    async def book(i):
+        hold_id = await client.inventory.hold("AKBOARD")
+        await client.inventory.commit(hold_id, "AKBOARD", f"passenger_{i}", i, "Economy")
+        await asyncio.sleep(0.001 * (i % 20))
+
+    await asyncio.gather(*(book(i) for i in range(bookings)))
+    await asyncio.sleep(1)
+    renders = board.render_count
+    board.mark_dirty()
+    await asyncio.sleep(0.5)
+    task.cancel()
+    client.flight_listeners.remove(board.mark_dirty)
+
+    assert board.render_count == renders, "re-rendered without a change"
+    print(f"departure board: {bookings} bookings -> {channel.sends} send, {channel.edits} edits, {board.render_count} renders")
+
+
+def bench_board():
+    asyncio.run(run_board())
+
+
+async def run_picker(flights=2_000, bookings=1_000):
+    client = loaded_client()
+    for i in range(flights):
+        add_fake_flight(f"AKP{i:04d}", bookings, f"2099-01-{1 + i % 28:02d} {i % 24:02d}:00")
+    index = client.flight_index
+    index.option_pages()
+    built = index.built_version
+
+    started = time.perf_counter()
+    for i in range(bookings):
+        flight_code = f"AKP{i % flights:04d}"
+        hold_id = await client.inventory.hold(flight_code)
+        await client.inventory.commit(hold_id, flight_code, f"picker_{i}", 600000000000000000 + i, "Economy")
+        index.option_pages()
+    elapsed = time.perf_counter() - started
+
+    option = next(o for page in index.option_pages() for o in page if o.value == "AKP0000")
+    assert index.built_version == built, "a sale rebuilt the flight index"
+    assert f"{bookings - 1} spots" in option.description, "sold seat missing from the picker"
+
+    moved = f"AKP{flights - 1:04d}"
+    client.flights[moved]["departure"] = "2098-01-01 10:00"
+    client.save_flight(moved)
+    order = [o.value for page in index.option_pages() for o in page if o.value.startswith("AKP")]
+    assert order[0] == moved, "rescheduled flight kept its old place"
+    print(f"picker: {bookings} sales over {flights} flights, no rebuilds, "
+          f"{elapsed / bookings * 1e6:.0f}us per sale and page lookup")
+
+
+def bench_picker():
+    asyncio.run(run_picker())
+
+
+async def run_watcher():
+    # another process edits a flight while we sell a seat during the watcher's read,
+    # the reload must take the edit without putting the sold seat back
+    client = loaded_client()
+    add_fake_flight("AKWATCH", 2)
+    add_fake_flight("AKEDIT", 5)
+    await client.store.barrier()
+    await asyncio.sleep(0.1)
+    client.watcher.token = client.store.change_token()
+
+    if bot.STORAGE_BACKEND == "json":
+        other = bot.JsonStore()
+    else:
+        other = bot.SQLiteStore(client.store.path)
+    other.load_flights()
+    other.save_flight("AKEDIT", dict(client.flights["AKEDIT"], route="GATWICK → SEOUL"))
+    other.close()
+
+    read = client.store.read_flights
+
+    def slow_read():
+        flights = read()
+        time.sleep(0.3)
+        return flights
+
+    async def sell(i):
+        hold_id = await client.inventory.hold("AKWATCH")
+        booking_code, _ = await client.inventory.commit(hold_id, "AKWATCH", f"watch_{i}", 700000000000000000 + i, "Economy")
+        return booking_code
+
+    client.store.read_flights = slow_read
+    reload = asyncio.create_task(client.watcher.reload())
+    await asyncio.sleep(0.1)
+    sold = [await sell(0)]
+    await reload
+    client.store.read_flights = read
+
+    assert client.flights["AKEDIT"]["route"] == "GATWICK → SEOUL", "external edit not picked up"
+    assert client.flights["AKWATCH"]["spots_left"] == 1, "reload put a sold seat back"
+    sold += [code for code in [await sell(i) for i in range(1, 4)] if code]
+    assert len(sold) == 2 and len(client.bookings["AKWATCH"]) == 2, f"sold {len(sold)} of 2 seats"
+    print("watcher: seat sold during a reload kept, external edit applied, no oversell")
+
+
+def bench_watcher():
+    asyncio.run(run_watcher())
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+async def run_scheduler(passengers=200):
+    client = loaded_client()
+    clock = FakeClock(4_000_000_000)
+    departure = datetime.fromtimestamp(clock.now + 3 * 3600, timezone.utc).strftime("%Y-%m-%d %H:%M")
+    departure_ts = bot.departure_timestamp(departure)
+    add_fake_flight("AKSCHED", passengers, departure)
+    for i in range(passengers):
+        hold_id = await client.inventory.hold("AKSCHED")
+        await client.inventory.commit(hold_id, "AKSCHED", f"passenger_{i}", 200000000000000000 + i, "Economy")
+
+    sent = []
+
+    async def deliver(user_id, message):
+        sent.append((user_id, message['embed'].title))
+
+    client.dms.deliver = deliver
+    client.dms.start()
+
+    async def step(scheduler, seconds_before_departure):
+        clock.now = departure_ts - seconds_before_departure
+        await scheduler.run_due()
+        await client.dms.queue.join()
+
+    scheduler = bot.FlightScheduler(client, clock=clock)
+    scheduler.flights_changed(["AKSCHED"])
+    await step(scheduler, 3 * 3600)
+    assert not sent
+    await step(scheduler, bot.CHECKIN_OPENS_BEFORE)
+    assert len(sent) == passengers
+
+    # a restart gets a fresh scheduler over the same store and must not resend
+    scheduler = bot.FlightScheduler(client, clock=clock)
+    scheduler.flights_changed(["AKSCHED"])
+    await step(scheduler, bot.CHECKIN_OPENS_BEFORE)
+    assert len(sent) == passengers, "check-in reminder sent twice"
+
+    started = time.perf_counter()
+    await step(scheduler, bot.BOARDING_REMINDER_BEFORE)
+    elapsed = time.perf_counter() - started
+    assert len(sent) == 2 * passengers
+    assert len(set(sent)) == len(sent), "duplicate reminder"
+
+    await step(scheduler, -bot.ARCHIVE_AFTER)
+    assert "AKSCHED" not in client.flights, "departed flight not archived"
+    print(f"scheduler: {len(sent)} reminders, no duplicates across restart, "
+          f"{passengers} boarding DMs queued and drained in {elapsed * 1000:.1f}ms")
+
+
+def bench_scheduler():
+    asyncio.run(run_scheduler())
+
+
+def multiproc_worker(flight_code, attempts, results):
+    # runs in its own process with its own client, sharing only the database file
+    async def run():
+        client = loaded_client()
+
+        async def book(i):
+            hold_id = await client.inventory.hold(flight_code)
+            if hold_id is None:
+                return None
+            booking_code, _ = await client.inventory.commit(hold_id, flight_code, f"passenger_{os.getpid()}_{i}", i, "Economy")
+            return booking_code
+
+        codes = await asyncio.gather(*(book(i) for i in range(attempts)))
+        return [code for code in codes if code]
+
+    results.put(asyncio.run(run()))
+
+
+def bench_multiproc(workers=2, seats=300, attempts=400):
+    if not isinstance(loaded_client().store, bot.SQLiteStore):
+        print("multiproc: needs the sqlite backend, skipped")
+        return
+
+    add_fake_flight("AKMULTI", seats)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=multiproc_worker, args=("AKMULTI", attempts, results)) for _ in range(workers)]
+
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    sold = [code for _ in processes for code in results.get()]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    store = bot.SQLiteStore(bot.client.store.path)
+    booked = store.load_bookings().get("AKMULTI", [])
+    spots_left = store.load_flights()["AKMULTI"]["spots_left"]
+
+    assert len(sold) == seats, f"sold {len(sold)} of {seats} seats"
+    assert len(booked) == seats and spots_left == 0, "store and sales disagree"
+    assert len({b.booking_code for b in booked}) == seats, "seat sold twice"
+    print(f"multiproc: {workers} workers x {attempts} attempts on {seats} seats -> "
+          f"{len(sold)} sold, none twice, {elapsed:.2f}s")
+
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.roles = []
+        self.mention = f"<@{user_id}>"
+        self.display_name = f"user{user_id}"
+        self.display_avatar = FakeAvatar()
+
+
+class FakeResponse:
+    # records what a handler answered with instead of calling discord
+    def __init__(self):
+        self.messages = []
+        self.view = None
+        self.modal = None
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append(content)
+        self.view = kwargs.get("view", self.view)
+
+    async def edit_message(self, **kwargs):
+        self.view = kwargs.get("view", self.view)
+
+    async def send_modal(self, modal):
+        self.modal = modal
+
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, client, user_id, data=None):
+        self.client = client
+        self.user = FakeUser(user_id)
+        self.data = data or {}
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+def find_item(view, cls, **attrs):
+    return next(item for item in view.children
+                if isinstance(item, cls) and all(getattr(item, k) == v for k, v in attrs.items()))
+
+
+async def book_through_flow(client, user_id, flight_code, roblox_username, cabin_class):
+    # /bookflight -> flight select -> Myself -> username modal -> cabin class,
+    # each step through the same component callbacks discord would invoke
+    interaction = FakeInteraction(client, user_id)
+    await bot.book_flight.callback(interaction)
+    menu = find_item(interaction.response.view, bot.FlightSelectMenu)
+
+    interaction = FakeInteraction(client, user_id, {"values": [flight_code]})
+    await menu.callback(interaction)
+    button = find_item(interaction.response.view, bot.BookingTypeButton, kind="m")
+
+    interaction = FakeInteraction(client, user_id)
+    await button.callback(interaction)
+    modal = interaction.response.modal
+    modal.username._value = roblox_username
+
+    interaction = FakeInteraction(client, user_id)
+    await modal.on_submit(interaction)
+    button = find_item(interaction.response.view, bot.CabinButton, cabin_class=cabin_class)
+
+    interaction = FakeInteraction(client, user_id)
+    await button.callback(interaction)
+    return interaction.response.messages[-1]
+
+
+async def run_stress(seats=100, attempts=500):
+    # hold -> commit through the same handlers as the booking flow, all racing for one
+    # flight in one process, every tenth flow double clicks its cabin button
+    client = loaded_client()
+    add_fake_flight("AKSTRESS", seats)
+
+    async def deliver(user_id, message):
+        pass
+
+    # its workers die with this run's loop, later runs get the bot's own queue back
+    dms, client.dms = client.dms, bot.DMQueue(client)
+    client.dms.deliver = deliver
+    client.dms.start()
+
+    async def attempt(i):
+        user_id = 500000000000000000 + i
+        interaction = FakeInteraction(client, user_id)
+        await bot.start_cabin_selection(client, interaction, "AKSTRESS", user_id, f"stress_{i}", None, "")
+        await asyncio.sleep(0.001 * (i % 7))
+
+        clicks = 2 if i % 10 == 0 else 1
+        interactions = [FakeInteraction(client, user_id) for _ in range(clicks)]
+        await asyncio.gather(*(bot.complete_booking(client, interaction, "AKSTRESS", user_id, f"stress_{i}", None, "Economy")
+                               for interaction in interactions))
+        return [interaction.response.messages[-1] for interaction in interactions]
+
+    started = time.perf_counter()
+    replies = await asyncio.gather(*(attempt(i) for i in range(attempts)))
+    elapsed = time.perf_counter() - started
+    await client.dms.queue.join()
+
+    codes = []
+    for flow in replies:
+        confirmed = [r for r in flow if r.startswith("✅ Booking confirmed")]
+        again = [r for r in flow if r.startswith("✅ Already booked")]
+        assert len(confirmed) <= 1, "one flow booked twice"
+        assert not again or confirmed, "double click answered without a booking"
+        assert all(r.split("`")[1] == c.split("`")[1] for r in again for c in confirmed), "double click got another code"
+        codes += [c.split("`")[1] for c in confirmed]
+
+    booked = client.store.load_bookings().get("AKSTRESS", [])
+    assert len(codes) == seats, f"sold {len(codes)} of {seats} seats"
+    assert len(set(codes)) == seats, "booking code handed out twice"
+    assert client.flights["AKSTRESS"]["spots_left"] == 0
+    assert client.index.passenger_count("AKSTRESS") == seats
+    assert sorted(b.booking_code for b in booked) == sorted(codes), "store and replies disagree"
+    client.dms = dms
+    print(f"stress: {attempts} flows on {seats} seats -> {len(codes)} sold, no code twice, {elapsed:.2f}s")
+
+
+def bench_stress():
+    asyncio.run(run_stress())
+
+
+class RobloxStub:
+    # answers the users lookup like roblox does, every username not in missing exists.
+    # runs on its own loop in a thread so it doesn't show up in the bot's loop lag
+    def __init__(self):
+        self.port = None
+        self.request_bytes = 0
+        self.requests = 0
+        self.batches = []
+        self.missing = set()  # usernames answered as not existing
+        self.status = 200
+        self.delay = 0
+
+    async def handle(self, request):
+        body = await request.read()
+        self.requests += 1
+        # what the client wrote to the socket, so it can be told apart from file writes
+        self.request_bytes += (len(body) + sum(len(k) + len(v) + 4 for k, v in request.raw_headers)
+                               + len(request.method) + len(request.raw_path) + len(" HTTP/1.1\r\n\r\n") + 1)
+        usernames = json.loads(body)["usernames"]
+        self.batches.append(len(usernames))
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response({"data": [{"requestedUsername": name, "name": name, "id": i}
+                                           for i, name in enumerate(usernames) if name not in self.missing]})
+
+    def start(self):
+        started = threading.Event()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_post("/v1/usernames/users", self.handle)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+        started.wait()
+        return f"http://127.0.0.1:{self.port}/v1/usernames/users"
+
+
+async def run_roblox(batch=50):
+    stub = RobloxStub()
+    clock = FakeClock(0)
+    validator = bot.RobloxValidator(stub.start())
+    validator.cache = bot.TTLCache(batch + 2, clock=clock)
+    validator.breaker = bot.CircuitBreaker(threshold=2, reset_after=30, clock=clock)
+
+    async def requests_for(*usernames):
+        before = stub.requests
+        results = await asyncio.gather(*(validator.check(name) for name in usernames))
+        return stub.requests - before, results
+
+    # names submitted within the batch window share one request
+    names = [f"pilot_{i}" for i in range(batch)]
+    sent, results = await requests_for(*names)
+    assert sent == 1 and stub.batches[-1] == batch and all(results), "batch split up"
+    sent, results = await requests_for(*names)
+    assert sent == 0 and all(results), "cached names asked again"
+
+    # unknown names are cached too, for less time
+    stub.missing.add("ghost_pilot")
+    assert await requests_for("ghost_pilot") == (1, [False])
+    assert await requests_for("ghost_pilot") == (0, [False]), "negative answer not cached"
+    clock.now += bot.ROBLOX_NEGATIVE_CACHE_TTL
+    assert await requests_for("ghost_pilot") == (1, [False]), "negative answer outlived its ttl"
+    assert await requests_for(names[0]) == (0, [True])
+    clock.now += bot.ROBLOX_CACHE_TTL
+    assert await requests_for(names[0]) == (1, [True]), "answer outlived its ttl"
+
+    # the cache holds batch + 2, the least recently used name goes first
+    await requests_for("extra_pilot_1", "extra_pilot_2")
+    assert await requests_for(names[1]) == (1, [True]), "least recently used name kept"
+    assert await requests_for(names[0]) == (0, [True]), "recently used name evicted"
+
+    # roblox failing lets people through, then stops asking until a single probe
+    stub.status = 500
+    assert await requests_for("down_1") == (1, [True])
+    assert await requests_for("down_2") == (1, [True])
+    assert await requests_for("down_3") == (0, [True]), "breaker didn't open"
+    clock.now += 30
+    stub.delay = 0.2
+    probe = asyncio.create_task(requests_for("probe_1"))
+    await asyncio.sleep(0.05)
+    assert await requests_for("probe_2", "probe_3") == (0, [True, True]), "half open sent more than one probe"
+    assert await probe == (1, [True])
+    stub.delay = 0
+    assert await requests_for("down_4") == (0, [True]), "failed probe didn't reopen the breaker"
+    stub.status = 200
+    clock.now += 30
+    assert await requests_for("probe_a") == (1, [True])
+    assert await requests_for("probe_b", "probe_c") == (1, [True, True]), "breaker didn't close"
+
+    assert not validator.lookups
+    await validator.close()
+    print(f"roblox: {batch} names in 1 request, ttl, lru and negative cache hold, breaker probes once "
+          f"({stub.requests} requests)")
+
+
+def bench_roblox():
+    asyncio.run(run_roblox())
+
+
+def written_bytes():
+    # bytes this process handed to write(), files and sockets alike
+    with open("/proc/self/io") as f:
+        return int(next(line for line in f if line.startswith("wchar")).split()[1])
+
+
+def load_worker(bookings, concurrency, roblox_url):
+    async def run():
+        client = loaded_client()
+        client.roblox.url = roblox_url
+        add_fake_flight("AKLOAD", bookings)
+
+        async def deliver(user_id, message):
+            pass
+
+        client.dms.deliver = deliver
+        client.dms.start()
+        monitor = bot.LoopMonitor(interval=0.01, warn=float("inf"))
+        monitor_task = asyncio.create_task(monitor.run())
+
+        cabins = [name for name, _ in bot.CABIN_CLASSES]
+        latencies = []
+        queue = asyncio.Queue()
+        for i in range(bookings):
+            queue.put_nowait(i)
+
+        async def virtual_user():
+            while not queue.empty():
+                i = queue.get_nowait()
+                started = time.perf_counter()
+                reply = await book_through_flow(client, 300000000000000000 + i, "AKLOAD", f"load_{i}", cabins[i % len(cabins)])
+                latencies.append(time.perf_counter() - started)
+                assert reply.startswith("✅ Booking confirmed"), reply
+
+        written = written_bytes()
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        written = written_bytes() - written
+        await client.dms.queue.join()
+        monitor_task.cancel()
+
+        assert client.flights["AKLOAD"]["spots_left"] == 0
+        assert client.index.passenger_count("AKLOAD") == bookings
+        lag = bot.metrics.histogram("event_loop_lag_seconds")
+        latencies.sort()
+        return {
+            "elapsed": elapsed,
+            "p50": latencies[len(latencies) // 2],
+            "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            "lag_p99": lag.quantile(0.99),
+            "lag_max": lag.max,
+            "written": written,
+        }
+
+    return asyncio.run(run())
+
+
+def seed_store(existing, flights=200):
+    # a fresh store per run, filled before the bot process starts so startup loads it
+    directory = tempfile.mkdtemp()
+    env = {
+        "DATABASE_FILE": os.path.join(directory, "load.db"),
+        "FLIGHTS_FILE": os.path.join(directory, "flights.json"),
+        "BOOKINGS_FILE": os.path.join(directory, "bookings.json"),
+        "META_FILE": os.path.join(directory, "meta.json"),
+        "ARCHIVE_FILE": os.path.join(directory, "archived_flights.json"),
+        "METRICS_PORT": "0",
+    }
+    if bot.STORAGE_BACKEND == "json":
+        store = bot.JsonStore(env["FLIGHTS_FILE"], env["BOOKINGS_FILE"], env["META_FILE"], env["ARCHIVE_FILE"])
+    else:
+        store = bot.SQLiteStore(env["DATABASE_FILE"])
+
+    bookings = fake_bookings(existing, flights)
+    store.save_all_flights({f"AK{i:04d}": {
+        "route": "HEATHROW → KOSICE",
+        "aircraft": "Airbus A320-271N",
+        "spots_left": 10,
+        "capacity": 10 + len(bookings.get(f"AK{i:04d}", [])),
+        "departure": "2099-01-01 10:00",
+        "timezone": "Europe/London"
+    } for i in range(flights)})
+    store.save_all_bookings(bookings)
+    store.close()
+    return env
+
+
+def startup_worker():
+    started = time.perf_counter()
+    bot.client.load_state()
+    return time.perf_counter() - started, len(bot.client.flights), len(bot.client.index.by_code)
+
+
+def bench_startup(sizes=(1_000, 10_000, 100_000)):
+    # how long loading state takes in a fresh process, the gateway connect now runs alongside it
+    context = multiprocessing.get_context("spawn")
+    print(f"startup: loading state in a fresh process, {bot.STORAGE_BACKEND} backend")
+    for existing in sizes:
+        env = seed_store(existing)
+        saved = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        try:
+            with context.Pool(1) as pool:
+                elapsed, flights, bookings = pool.apply(startup_worker)
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    del os.environ[key]
+                else:
+                    os.environ[key] = value
+        print(f"  {existing:>7} existing: {flights} flights, {bookings} bookings loaded in {elapsed * 1000:.0f}ms")
+
+
+def bench_load(sizes=(1_000, 10_000, 100_000), bookings=1_000, concurrency=50):
+    stub = RobloxStub()
+    roblox_url = stub.start()
+    context = multiprocessing.get_context("spawn")
+
+    print(f"load: {bookings} bookings through the full flow, {concurrency} concurrent users, "
+          f"{bot.STORAGE_BACKEND} backend")
+    for existing in sizes:
+        env = seed_store(existing)
+        saved = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        stub.request_bytes = stub.requests = 0
+        try:
+            # a fresh process per run so the bot starts up against the seeded store
+            with context.Pool(1) as pool:
+                result = pool.apply(load_worker, (bookings, concurrency, roblox_url))
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    del os.environ[key]
+                else:
+                    os.environ[key] = value
+
+        file_bytes = max(0, result['written'] - stub.request_bytes)
+        print(f"  {existing:>7} existing: {bookings / result['elapsed']:8.1f} bookings/s  "
+              f"p50 {result['p50'] * 1000:6.1f}ms  p99 {result['p99'] * 1000:6.1f}ms  "
+              f"loop lag p99 {result['lag_p99'] * 1000:.0f}ms max {result['lag_max'] * 1000:.0f}ms  "
+              f"{file_bytes / bookings:,.0f} bytes written/booking  ({stub.requests} roblox requests)")
+
+
+BENCHMARKS = {
+    "index": bench_index,
+    "memory": bench_memory,
+    "codes": bench_codes,
+    "board": bench_board,
+    "picker": bench_picker,
+    "watcher": bench_watcher,
+    "scheduler": bench_scheduler,
+    "multiproc": bench_multiproc,
+    "stress": bench_stress,
+    "roblox": bench_roblox,
+    "load": bench_load,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Korean Air bot benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"any of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--bookings", type=int, default=1_000, help="load: bookings to make per run")
+    parser.add_argument("--concurrency", type=int, default=50, help="load: users booking at once")
+    parser.add_argument("--existing", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="load/startup: bookings already in the store, one run per size")
+    args = parser.parse_args()
+    options = {"load": dict(sizes=args.existing, bookings=args.bookings, concurrency=args.concurrency),
+               "startup": dict(sizes=args.existing)}
+
+    for name in args.benchmarks or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            sys.exit(f"unknown benchmark: {name}")
+        print(f"== {name}")
+        BENCHMARKS[name](**options.get(name, {}))
@@ -2,147 +2,2833 @@ import discord
 from discord import app_commands
 from discord.ui import Button, View, Select, Modal, TextInput
 import json, random
+import hashlib
 import string
 import asyncio
-from datetime import datetime
+from datetime import datetime, date, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import aiohttp
+from aiohttp import web
 from typing import Optional
+from urllib.parse import quote, unquote
 import os
+import io
+import csv
+import sqlite3
+import threading
+import time
+import secrets
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from functools import lru_cache, wraps
+import bisect
+import heapq
+import itertools
+import re
+import atexit
+from enum import IntEnum
+from dataclasses import dataclass
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 ADMIN_ROLE_NAME = "Digital Technology Chief" # was changed to role id 
-FLIGHTS_FILE = "flights.json"
-BOOKINGS_FILE = "bookings.json"
+FLIGHTS_FILE = os.getenv("FLIGHTS_FILE", "flights.json")
+BOOKINGS_FILE = os.getenv("BOOKINGS_FILE", "bookings.json")
+META_FILE = os.getenv("META_FILE", "meta.json")
+ARCHIVE_FILE = os.getenv("ARCHIVE_FILE", "archived_flights.json")
+DATABASE_FILE = os.getenv("DATABASE_FILE", "korean_air.db")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")  # "sqlite" or "json"
+JSON_FLUSH_INTERVAL = 0.05  # seconds a change can sit in memory before the json files are rewritten
+JSON_FLUSH_MAX_CHANGES = 500  # or this many changes, whichever comes first
+HOLD_TIMEOUT = 300  # how long a seat stays held while the cabin class is picked
+
+# run several processes against one database by giving each its own SHARD_IDS, e.g. "0,1" and "2,3"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+LEADER = SHARD_IDS is None or 0 in SHARD_IDS  # the process that owns shard 0 runs the board and reminders
+COMMAND_GUILDS = [int(g) for g in os.getenv("COMMAND_GUILDS", "").split(",") if g.strip()]  # sync commands to these guilds instead of globally
+STATE_LOAD_WAIT = 2  # seconds an interaction that arrives mid-startup waits for the stores, inside discord's 3s
+FLIGHT_WATCH_INTERVAL = 2  # seconds between change checks, a stat/pragma is cheap
+
+ROBLOX_USERS_URL = os.getenv("ROBLOX_USERS_URL", "https://users.roblox.com/v1/usernames/users")
+ROBLOX_TIMEOUT = 1.5  # has to fit inside discord's 3 second interaction window
+ROBLOX_BATCH_WINDOW = 0.005
+ROBLOX_BATCH_SIZE = 100
+ROBLOX_CACHE_SIZE = 10000
+ROBLOX_CACHE_TTL = 3600
+ROBLOX_NEGATIVE_CACHE_TTL = 300
+
+CUSTOM_ID_LIMIT = 100  # discord rejects longer component custom_ids
+FLIGHT_KEY_LIMIT = 28  # longest encoded flight code that still fits the longest booking flow custom_id
+ROUTE_FILTER_LIMIT = 40
+PICKER_PAGE_SIZE = 25  # discord's limit for options in one select
+PICKER_CACHE_TTL = 60  # departed flights drop off the picker within a minute
+
+DEPARTURE_BOARD_CHANNELS = [int(c) for c in os.getenv("DEPARTURE_BOARD_CHANNELS", "").split(",") if c.strip()]
+BOARD_DEBOUNCE = 5  # seconds to wait for a burst of changes to settle before editing
+BOARD_MIN_EDIT_INTERVAL = 2  # per channel, keeps us well under discord's 5 edits / 5s
+BOARD_REFRESH = 60  # re-check statuses (boarding, departed) even if nothing changed
+BOARD_ROWS = 20
+
+CHECKIN_OPENS_BEFORE = int(os.getenv("CHECKIN_OPENS_BEFORE", 2 * 3600))  # seconds before departure
+BOARDING_REMINDER_BEFORE = int(os.getenv("BOARDING_REMINDER_BEFORE", 30 * 60))
+ARCHIVE_AFTER = int(os.getenv("ARCHIVE_AFTER", 3600))  # seconds after departure
+DM_WORKERS = 5  # DMs in flight at once, keeps a full flight's reminders under the global rate limit
+DM_QUEUE_SIZE = 1000
+DM_MAX_ATTEMPTS = 5
+DM_RETRY_BASE = 1  # seconds, doubled on every retry
+DEPARTURE_FORMAT = "%Y-%m-%d %H:%M"  # always UTC, the timezone field is only shown to passengers
+IMPORT_MAX_BYTES = 1024 * 1024
+IMPORT_MAX_ROWS = 2000
+IMPORT_MAX_ERRORS = 10  # stop reading once this many bad rows have been found
+TEMPLATE_HORIZON = 7 * 86400  # recurring flights are only created this far ahead
+TEMPLATE_INTERVAL = 3600  # seconds between pushing the horizon forward
+TEMPLATE_MAX_DAYS = 366
+WAITLIST_SWEEP = 30  # seconds between checks for seats freed some other way than /cancel
+
+CABIN_CLASSES = [("Economy", "💺"), ("Premium Economy", "🪑"), ("Business", "🛋️"), ("First Class", "👑")]
+MANIFEST_SECTIONS = [("First Class", "First Class"), ("Business", "Business Class"),
+                     ("Premium Economy", "Premium Economy"), ("Economy", "Economy Class")]
+EMBED_FIELD_LIMIT = 1024
+EMBED_TOTAL_LIMIT = 5500  # discord allows 6000, leave room for title/footer
+EMBED_MAX_FIELDS = 25
+STATS_BUCKET_SECONDS = 60
+STATS_BUCKETS = 24 * 60  # a day of per-minute booking counts
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10)
+INTERACTION_DEADLINE = 3  # discord drops an interaction that isn't answered within 3s
+INTERACTION_DEADLINE_WARN = 2
+LOOP_LAG_INTERVAL = 0.5
+LOOP_LAG_WARN = 0.1  # a sleep overshooting by this much means something blocked the loop
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))  # 0 turns the endpoint off, shards add their first shard id
+ASYNCIO_DEBUG = os.getenv("ASYNCIO_DEBUG") == "1"
+SLOW_CALLBACK_DURATION = float(os.getenv("SLOW_CALLBACK_DURATION", 0.1))
+
+intents = discord.Intents.default()
+intents.message_content = True
+intents.members = True
+
+
+class CabinClass(IntEnum):
+    ECONOMY = 0
+    PREMIUM_ECONOMY = 1
+    BUSINESS = 2
+    FIRST_CLASS = 3
+
+    @property
+    def label(self):
+        return CABIN_CLASSES[self][0]
+
+    @classmethod
+    def parse(cls, label):
+        # anything that isn't one of ours passes through as the string it came in as
+        return CABIN_BY_LABEL.get(label, label)
+
+
+CABIN_BY_LABEL = {name: CabinClass(i) for i, (name, _) in enumerate(CABIN_CLASSES)}
+EPOCH = datetime(1970, 1, 1)
+
+
+def cabin_label(cabin_class):
+    return cabin_class.label if isinstance(cabin_class, CabinClass) else cabin_class
+
+
+def parse_booked_at(value):
+    # the stored form is datetime.utcnow().isoformat(), which maps back exactly
+    try:
+        booked_at = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+    if booked_at.tzinfo is not None or booked_at.isoformat() != value:
+        return value
+    return (booked_at - EPOCH) // timedelta(microseconds=1)
+
+
+def format_booked_at(value):
+    if isinstance(value, int):
+        return (EPOCH + timedelta(microseconds=value)).isoformat()
+    return value
+
+
+@dataclass
+class Booking:
+    # one per seat sold. slots, an enum and an int instead of a five-key dict,
+    # an iso string and a repeated cabin name
+    __slots__ = ("booking_code", "roblox_username", "discord_id", "cabin_class", "booked_at")
+    booking_code: str
+    roblox_username: str
+    discord_id: int
+    cabin_class: CabinClass
+    booked_at: int  # utc epoch microseconds
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['booking_code'], data['roblox_username'], data['discord_id'],
+                   CabinClass.parse(data['cabin_class']), parse_booked_at(data['booked_at']))
+
+    def to_dict(self):
+        return {
+            "booking_code": self.booking_code,
+            "roblox_username": self.roblox_username,
+            "discord_id": self.discord_id,
+            "cabin_class": cabin_label(self.cabin_class),
+            "booked_at": format_booked_at(self.booked_at)
+        }
+
+    def timestamp(self):
+        return self.booked_at / 1e6 if isinstance(self.booked_at, int) else None
+
+
+class FlightStore:
+    def load_flights(self):
+        raise NotImplementedError
+
+    def read_flights(self):
+        # safe to call from a worker thread, doesn't touch any cached state
+        return self.load_flights()
+
+    def sync_flights(self, flights):
+        pass
+
+    def change_token(self):
+        # changes whenever someone other than us wrote flights
+        return None
+
+    def save_flight(self, flight_code, flight_data):
+        raise NotImplementedError
+
+    def save_flight_info(self, flight_code, flight_data):
+        # everything but spots_left, which another process may be selling from
+        raise NotImplementedError
+
+    def delete_flight(self, flight_code, with_bookings=False):
+        # with_bookings also drops the flight's bookings and waitlist in the same write
+        raise NotImplementedError
+
+    def save_all_flights(self, flights):
+        raise NotImplementedError
+
+    def add_flights(self, flights):
+        # inserts the flights that don't exist yet in one write and returns their codes,
+        # a code someone else already created is left alone
+        raise NotImplementedError
+
+    def archive_flight(self, flight_code, flight_data):
+        raise NotImplementedError
+
+
+class MetaStore:
+    def get_meta(self, key, default=None):
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        raise NotImplementedError
+
+
+class BookingStore:
+    def load_bookings(self):
+        raise NotImplementedError
+
+    def book_seat(self, flight_code, booking_info):
+        # take one seat and record the booking atomically, returns the new
+        # spots_left or None if the flight is full
+        raise NotImplementedError
+
+    def cancel_booking(self, flight_code, booking_code):
+        # drop the booking and give its seat back atomically, returns the new
+        # spots_left or None if there was no such booking
+        raise NotImplementedError
+
+    def waitlist(self, flight_code):
+        # entries are dicts: id, discord_id, booker_id, roblox_username, cabin_class, joined_at
+        raise NotImplementedError
+
+    def waitlisted_flights(self):
+        raise NotImplementedError
+
+    def waitlist_for_user(self, discord_id):
+        # [(flight_code, entry)]
+        raise NotImplementedError
+
+    def join_waitlist(self, flight_code, entry):
+        raise NotImplementedError
+
+    def pop_waitlist(self, flight_code):
+        # removes and returns the first entry, None if nobody is waiting
+        raise NotImplementedError
+
+    def restore_waitlist(self, flight_code, entry):
+        # puts a popped entry back where it was
+        raise NotImplementedError
+
+    def booking_cursor(self):
+        return None
+
+    def booking_changes(self, cursor):
+        # bookings added / codes removed by other processes since cursor
+        return [], [], cursor
+
+    def save_all_bookings(self, bookings):
+        raise NotImplementedError
+
+    async def barrier(self):
+        # returns once everything written so far is on disk
+        pass
+
+    def close(self):
+        pass
+
+
+class BookingCodeTaken(Exception):
+    pass
+
+
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def write_temp(path, data):
+    # the caller os.replace()s it over path, so a crash leaves either the old
+    # file or the new one, never half of one
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+class WriteBehind:
+    # mutations mark a file dirty and return straight away. a worker thread writes
+    # dirty files at most every JSON_FLUSH_INTERVAL (sooner after JSON_FLUSH_MAX_CHANGES),
+    # so a burst of bookings costs one rewrite instead of one each
+    ORDER = ["archive", "flights", "bookings", "meta"]  # a crash between files loses a booking, never a seat
+
+    def __init__(self, store, interval=JSON_FLUSH_INTERVAL, max_changes=JSON_FLUSH_MAX_CHANGES):
+        self.store = store
+        self.interval = interval
+        self.max_changes = max_changes
+        self.condition = threading.Condition()
+        self.pending = threading.Event()
+        self.full = threading.Event()
+        self.dirty = set()
+        self.generation = 0  # bumped on every change
+        self.written = 0  # generation that's on disk
+        self.waiters = []  # (generation, loop, future) for barrier()
+        self.thread = None
+        self.closing = False
+        self.flushes = 0
+        self.bytes_written = 0
+
+    def mark(self, name):
+        with self.condition:
+            self.dirty.add(name)
+            self.generation += 1
+            if self.generation - self.written >= self.max_changes:
+                self.full.set()
+            self.pending.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="json-writer", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def write(self, dirty):
+        started = time.perf_counter()
+        names = [name for name in self.ORDER if name in dirty]
+        for i, name in enumerate(names):
+            path, data = self.store.snapshot(name)
+            try:
+                encoded = encode_json(data)
+                self.store.replace(name, write_temp(path, encoded), path)
+            except Exception as e:
+                # this file and every one after it are retried, in order
+                print(f"Error writing {path}: {e}")
+                with self.condition:
+                    self.dirty.update(names[i:])
+                return False
+            self.bytes_written += len(encoded)
+        if dirty:
+            metrics.observe("store_flush_seconds", time.perf_counter() - started)
+        return True
+
+    def run(self):
+        while True:
+            self.pending.wait()
+            self.full.wait(self.interval)
+            with self.condition:
+                dirty, self.dirty = self.dirty, set()
+                generation = self.generation
+                self.pending.clear()
+                self.full.clear()
+                closing = self.closing
+
+            if not self.write(dirty):
+                time.sleep(self.interval)
+                self.pending.set()
+                continue
+
+            with self.condition:
+                self.written = generation
+                self.flushes += 1
+                self.condition.notify_all()
+                ready = [w for w in self.waiters if w[0] <= generation]
+                self.waiters = [w for w in self.waiters if w[0] > generation]
+            for _, loop, future in ready:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+            if closing:
+                return
+
+    async def barrier(self):
+        with self.condition:
+            if self.written >= self.generation:
+                return
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append((self.generation, asyncio.get_running_loop(), future))
+        await future
+
+    def flush(self, timeout=10):
+        with self.condition:
+            if self.thread is None:
+                return True
+            generation = self.generation
+            self.full.set()
+            self.pending.set()
+            return self.condition.wait_for(lambda: self.written >= generation, timeout)
+
+    def close(self):
+        if self.thread is None or not self.thread.is_alive():
+            return
+        with self.condition:
+            self.closing = True
+        self.flush()
+        self.thread.join(timeout=10)
+
+
+class JsonStore(FlightStore, BookingStore, MetaStore):
+    # the old flights.json / bookings.json layout. writes are coalesced by a WriteBehind
+    # and each file is replaced atomically
+    def __init__(self, flights_file=FLIGHTS_FILE, bookings_file=BOOKINGS_FILE, meta_file=META_FILE,
+                 archive_file=ARCHIVE_FILE):
+        self.flights_file = flights_file
+        self.bookings_file = bookings_file
+        self.meta_file = meta_file
+        self.archive_file = archive_file
+        self.flights = {}
+        self.bookings = {}
+        self.meta = None
+        self.archived = None
+        self.written_token = None
+        self.external_token = None
+        self.lock = threading.Lock()  # held while mutating, and by the writer while it copies
+        self.token_lock = threading.Lock()
+        self.writer = WriteBehind(self)
+
+    def read_json(self, path, default):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def snapshot(self, name):
+        # called from the writer thread, copies just deep enough that the loop
+        # can keep mutating while the copy is encoded
+        with self.lock:
+            if name == "flights":
+                return self.flights_file, {code: dict(data) for code, data in self.flights.items()}
+            if name == "bookings":
+                bookings = {code: list(passengers) for code, passengers in self.bookings.items()}
+            elif name == "meta":
+                return self.meta_file, dict(self.meta)
+            else:
+                return self.archive_file, dict(self.archived)
+        # bookings don't change once made, so they convert outside the lock
+        return self.bookings_file, {code: [b.to_dict() for b in passengers] for code, passengers in bookings.items()}
+
+    def replace(self, name, tmp, path):
+        # the token is taken in the same step as the replace, so the watcher never
+        # sees our own write before it knows the write is ours
+        with self.token_lock:
+            os.replace(tmp, path)
+            if name == "flights":
+                self.written_token = self.file_token()
+
+    def get_meta(self, key, default=None):
+        if self.meta is None:
+            self.meta = self.read_json(self.meta_file, {})
+        return self.meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self.get_meta(key)
+        with self.lock:
+            self.meta[key] = value
+        self.writer.mark("meta")
+
+    def read_flights(self):
+        flights = self.read_json(self.flights_file, None)
+        if flights is None:
+            print(f"Warning: {self.flights_file} not found, starting with empty flight list")
+            return {}
+        return flights
+
+    def load_flights(self):
+        self.flights = self.read_flights()
+        return dict(self.flights)
+
+    def sync_flights(self, flights):
+        with self.lock:
+            self.flights = dict(flights)
+
+    def file_token(self):
+        try:
+            stat = os.stat(self.flights_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def change_token(self):
+        with self.token_lock:
+            token = self.file_token()
+            if token != self.written_token:
+                self.external_token = token
+            return self.external_token
+
+    def save_flight(self, flight_code, flight_data):
+        with self.lock:
+            self.flights[flight_code] = flight_data
+        self.writer.mark("flights")
+
+    def save_flight_info(self, flight_code, flight_data):
+        self.save_flight(flight_code, flight_data)
+
+    def delete_flight(self, flight_code, with_bookings=False):
+        with self.lock:
+            self.flights.pop(flight_code, None)
+            if with_bookings:
+                self.bookings.pop(flight_code, None)
+        self.writer.mark("flights")
+        if with_bookings:
+            self.writer.mark("bookings")
+            waitlists = self.get_meta("waitlists", {})
+            if waitlists.pop(flight_code, None) is not None:
+                self.set_meta("waitlists", waitlists)
+
+    def save_all_flights(self, flights):
+        with self.lock:
+            self.flights = dict(flights)
+        self.writer.mark("flights")
+
+    def add_flights(self, flights):
+        with self.lock:
+            added = [code for code in flights if code not in self.flights]
+            for flight_code in added:
+                self.flights[flight_code] = flights[flight_code]
+        if added:
+            self.writer.mark("flights")
+        return added
+
+    def archive_flight(self, flight_code, flight_data):
+        if self.archived is None:
+            self.archived = self.read_json(self.archive_file, {})
+        with self.lock:
+            self.archived[flight_code] = flight_data
+        self.writer.mark("archive")
+        self.delete_flight(flight_code)
+
+    def load_bookings(self):
+        bookings = self.read_json(self.bookings_file, None)
+        if bookings is None:
+            print(f"Warning: {self.bookings_file} not found, starting with empty bookings")
+            bookings = {}
+        self.bookings = {code: [Booking.from_dict(b) for b in passengers] for code, passengers in bookings.items()}
+        return {code: list(passengers) for code, passengers in self.bookings.items()}
+
+    def book_seat(self, flight_code, booking_info):
+        # single process only, there's nothing to coordinate with
+        with self.lock:
+            flight_data = self.flights.get(flight_code)
+            if not flight_data or flight_data['spots_left'] <= 0:
+                return None
+            flight_data['spots_left'] -= 1
+            self.bookings.setdefault(flight_code, []).append(booking_info)
+        self.writer.mark("flights")
+        self.writer.mark("bookings")
+        return flight_data['spots_left']
+
+    def save_all_bookings(self, bookings):
+        with self.lock:
+            self.bookings = {code: list(passengers) for code, passengers in bookings.items()}
+        self.writer.mark("bookings")
+
+    def cancel_booking(self, flight_code, booking_code):
+        with self.lock:
+            passengers = self.bookings.get(flight_code, [])
+            remaining = [b for b in passengers if b.booking_code != booking_code]
+            if len(remaining) == len(passengers):
+                return None
+            self.bookings[flight_code] = remaining
+            flight_data = self.flights.get(flight_code)
+            if flight_data is None:
+                spots_left = 0
+            else:
+                flight_data['spots_left'] += 1
+                spots_left = flight_data['spots_left']
+        self.writer.mark("flights")
+        self.writer.mark("bookings")
+        return spots_left
+
+    # waitlists live in meta, {flight_code: [entry, ...]} in join order
+    def waitlist(self, flight_code):
+        return list(self.get_meta("waitlists", {}).get(flight_code, []))
+
+    def waitlisted_flights(self):
+        return [code for code, entries in self.get_meta("waitlists", {}).items() if entries]
+
+    def waitlist_for_user(self, discord_id):
+        return [(code, entry) for code, entries in self.get_meta("waitlists", {}).items()
+                for entry in entries if entry['discord_id'] == discord_id]
+
+    def join_waitlist(self, flight_code, entry):
+        entry = dict(entry, id=self.get_meta("waitlist_next_id", 1))
+        waitlists = self.get_meta("waitlists", {})
+        waitlists.setdefault(flight_code, []).append(entry)
+        self.set_meta("waitlist_next_id", entry['id'] + 1)
+        self.set_meta("waitlists", waitlists)
+        return entry
+
+    def pop_waitlist(self, flight_code):
+        waitlists = self.get_meta("waitlists", {})
+        entries = waitlists.get(flight_code)
+        if not entries:
+            return None
+        entry = entries.pop(0)
+        if not entries:
+            del waitlists[flight_code]
+        self.set_meta("waitlists", waitlists)
+        return entry
+
+    def restore_waitlist(self, flight_code, entry):
+        waitlists = self.get_meta("waitlists", {})
+        entries = waitlists.setdefault(flight_code, [])
+        entries.insert(bisect.bisect_left([e['id'] for e in entries], entry['id']), entry)
+        self.set_meta("waitlists", waitlists)
+
+    async def barrier(self):
+        await self.writer.barrier()
+
+    def close(self):
+        self.writer.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flights (
+    flight_code TEXT PRIMARY KEY,
+    spots_left INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    booking_code TEXT NOT NULL,
+    flight_code TEXT NOT NULL,
+    roblox_username TEXT NOT NULL,
+    discord_id INTEGER NOT NULL,
+    cabin_class TEXT NOT NULL,
+    booked_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deleted_bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    booking_code TEXT NOT NULL,
+    flight_code TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_flight_code ON bookings(flight_code);
+CREATE INDEX IF NOT EXISTS bookings_booking_code ON bookings(booking_code);
+CREATE TABLE IF NOT EXISTS archived_flights (
+    flight_code TEXT PRIMARY KEY,
+    spots_left INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waitlist (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    flight_code TEXT NOT NULL,
+    discord_id INTEGER NOT NULL,
+    booker_id INTEGER NOT NULL,
+    roblox_username TEXT NOT NULL,
+    cabin_class TEXT NOT NULL,
+    joined_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS waitlist_flight_code ON waitlist(flight_code, id);
+CREATE INDEX IF NOT EXISTS waitlist_discord_id ON waitlist(discord_id);
+"""
+
+
+class SQLiteStore(FlightStore, BookingStore, MetaStore):
+    # one row per flight / booking, a booking is a single indexed insert
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value))
+            )
+
+    def change_token(self):
+        # data_version only moves when another connection commits, our own writes don't count
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def is_empty(self):
+        with self.lock:
+            flights = self.conn.execute("SELECT COUNT(*) FROM flights").fetchone()[0]
+            bookings = self.conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+        return flights == 0 and bookings == 0
+
+    def load_flights(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT flight_code, spots_left, data FROM flights ORDER BY rowid").fetchall()
+        flights = {}
+        for flight_code, spots_left, data in rows:
+            flight_data = json.loads(data)
+            flight_data['spots_left'] = spots_left
+            flights[flight_code] = flight_data
+        return flights
+
+    def _flight_row(self, flight_code, flight_data):
+        data = {k: v for k, v in flight_data.items() if k != 'spots_left'}
+        return (flight_code, flight_data['spots_left'], json.dumps(data))
+
+    def save_flight(self, flight_code, flight_data):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO flights (flight_code, spots_left, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(flight_code) DO UPDATE SET spots_left = excluded.spots_left, data = excluded.data",
+                self._flight_row(flight_code, flight_data)
+            )
+
+    def save_flight_info(self, flight_code, flight_data):
+        with self.lock:
+            self.conn.execute("UPDATE flights SET data = ? WHERE flight_code = ?",
+                              self._flight_row(flight_code, flight_data)[2:] + (flight_code,))
+
+    def delete_flight(self, flight_code, with_bookings=False):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM flights WHERE flight_code = ?", (flight_code,))
+            if with_bookings:
+                # tombstones so other processes drop the bookings too
+                conn.execute(
+                    "INSERT INTO deleted_bookings (booking_code, flight_code) "
+                    "SELECT booking_code, flight_code FROM bookings WHERE flight_code = ? ORDER BY id",
+                    (flight_code,)
+                )
+                conn.execute("DELETE FROM bookings WHERE flight_code = ?", (flight_code,))
+                conn.execute("DELETE FROM waitlist WHERE flight_code = ?", (flight_code,))
+
+    def save_all_flights(self, flights):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM flights")
+            conn.executemany(
+                "INSERT INTO flights (flight_code, spots_left, data) VALUES (?, ?, ?)",
+                [self._flight_row(code, data) for code, data in flights.items()]
+            )
+
+    def add_flights(self, flights):
+        added = []
+        with self.transaction() as conn:
+            for flight_code, flight_data in flights.items():
+                cursor = conn.execute(
+                    "INSERT INTO flights (flight_code, spots_left, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(flight_code) DO NOTHING",
+                    self._flight_row(flight_code, flight_data)
+                )
+                if cursor.rowcount:
+                    added.append(flight_code)
+        return added
+
+    def archive_flight(self, flight_code, flight_data):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO archived_flights (flight_code, spots_left, data) VALUES (?, ?, ?)",
+                self._flight_row(flight_code, flight_data)
+            )
+            conn.execute("DELETE FROM flights WHERE flight_code = ?", (flight_code,))
+
+    def load_bookings(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT flight_code, booking_code, roblox_username, discord_id, cabin_class, booked_at "
+                "FROM bookings ORDER BY id"
+            ).fetchall()
+        bookings = {}
+        for flight_code, booking_code, roblox_username, discord_id, cabin_class, booked_at in rows:
+            bookings.setdefault(flight_code, []).append(Booking(
+                booking_code, roblox_username, discord_id, CabinClass.parse(cabin_class), parse_booked_at(booked_at)
+            ))
+        return bookings
+
+    def _booking_row(self, flight_code, booking):
+        # same text columns as before, so older versions can share the database
+        return (
+            booking.booking_code,
+            flight_code,
+            booking.roblox_username,
+            booking.discord_id,
+            cabin_label(booking.cabin_class),
+            format_booked_at(booking.booked_at)
+        )
+
+    def book_seat(self, flight_code, booking_info):
+        # BEGIN IMMEDIATE takes the database write lock, so this is atomic across processes
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM bookings WHERE booking_code = ?", (booking_info.booking_code,)).fetchone():
+                raise BookingCodeTaken(booking_info.booking_code)
+
+            updated = conn.execute(
+                "UPDATE flights SET spots_left = spots_left - 1 WHERE flight_code = ? AND spots_left > 0",
+                (flight_code,)
+            ).rowcount
+            if not updated:
+                return None
+
+            conn.execute(
+                "INSERT INTO bookings (booking_code, flight_code, roblox_username, discord_id, cabin_class, booked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._booking_row(flight_code, booking_info)
+            )
+            return conn.execute("SELECT spots_left FROM flights WHERE flight_code = ?", (flight_code,)).fetchone()[0]
+
+    def cancel_booking(self, flight_code, booking_code):
+        with self.transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM bookings WHERE booking_code = ? AND flight_code = ?",
+                (booking_code, flight_code)
+            ).rowcount
+            if not deleted:
+                return None
+            conn.execute(
+                "INSERT INTO deleted_bookings (booking_code, flight_code) VALUES (?, ?)",
+                (booking_code, flight_code)
+            )
+            conn.execute("UPDATE flights SET spots_left = spots_left + 1 WHERE flight_code = ?", (flight_code,))
+            row = conn.execute("SELECT spots_left FROM flights WHERE flight_code = ?", (flight_code,)).fetchone()
+            return row[0] if row else 0
+
+    WAITLIST_COLUMNS = ("id", "discord_id", "booker_id", "roblox_username", "cabin_class", "joined_at")
+
+    def waitlist(self, flight_code):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, discord_id, booker_id, roblox_username, cabin_class, joined_at "
+                "FROM waitlist WHERE flight_code = ? ORDER BY id",
+                (flight_code,)
+            ).fetchall()
+        return [dict(zip(self.WAITLIST_COLUMNS, row)) for row in rows]
+
+    def waitlisted_flights(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT flight_code FROM waitlist").fetchall()]
+
+    def waitlist_for_user(self, discord_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT flight_code, id, discord_id, booker_id, roblox_username, cabin_class, joined_at "
+                "FROM waitlist WHERE discord_id = ? ORDER BY id",
+                (discord_id,)
+            ).fetchall()
+        return [(row[0], dict(zip(self.WAITLIST_COLUMNS, row[1:]))) for row in rows]
+
+    def join_waitlist(self, flight_code, entry):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO waitlist (flight_code, discord_id, booker_id, roblox_username, cabin_class, joined_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (flight_code, entry['discord_id'], entry['booker_id'], entry['roblox_username'],
+                 entry['cabin_class'], entry['joined_at'])
+            )
+        return dict(entry, id=cursor.lastrowid)
+
+    def pop_waitlist(self, flight_code):
+        # popped inside one write transaction, so two processes never promote the same entry
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT id, discord_id, booker_id, roblox_username, cabin_class, joined_at "
+                "FROM waitlist WHERE flight_code = ? ORDER BY id LIMIT 1",
+                (flight_code,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM waitlist WHERE id = ?", (row[0],))
+        return dict(zip(self.WAITLIST_COLUMNS, row))
+
+    def restore_waitlist(self, flight_code, entry):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO waitlist (id, flight_code, discord_id, booker_id, roblox_username, cabin_class, joined_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry['id'], flight_code, entry['discord_id'], entry['booker_id'], entry['roblox_username'],
+                 entry['cabin_class'], entry['joined_at'])
+            )
+
+    def booking_cursor(self):
+        with self.lock:
+            last_booking = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM bookings").fetchone()[0]
+            last_deleted = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM deleted_bookings").fetchone()[0]
+        return (last_booking, last_deleted)
+
+    def booking_changes(self, cursor):
+        last_booking, last_deleted = cursor
+        with self.lock:
+            added = self.conn.execute(
+                "SELECT id, flight_code, booking_code, roblox_username, discord_id, cabin_class, booked_at "
+                "FROM bookings WHERE id > ? ORDER BY id",
+                (last_booking,)
+            ).fetchall()
+            removed = self.conn.execute(
+                "SELECT id, booking_code FROM deleted_bookings WHERE id > ? ORDER BY id",
+                (last_deleted,)
+            ).fetchall()
+
+        bookings = []
+        for row_id, flight_code, booking_code, roblox_username, discord_id, cabin_class, booked_at in added:
+            last_booking = row_id
+            bookings.append((flight_code, Booking(
+                booking_code, roblox_username, discord_id, CabinClass.parse(cabin_class), parse_booked_at(booked_at)
+            )))
+        if removed:
+            last_deleted = removed[-1][0]
+
+        return bookings, [booking_code for _, booking_code in removed], (last_booking, last_deleted)
+
+    def save_all_bookings(self, bookings):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM bookings")
+            conn.executemany(
+                "INSERT INTO bookings (booking_code, flight_code, roblox_username, discord_id, cabin_class, booked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [self._booking_row(code, b) for code, passengers in bookings.items() for b in passengers]
+            )
+
+
+def migrate_json_to_sqlite(store, flights_file=FLIGHTS_FILE, bookings_file=BOOKINGS_FILE):
+    # one-shot import of the old json files into an empty database
+    if store.get_meta("migrated_from_json") or not store.is_empty():
+        return False
+    if not os.path.exists(flights_file) and not os.path.exists(bookings_file):
+        return False
+
+    legacy = JsonStore(flights_file, bookings_file)
+    flights = legacy.load_flights() if os.path.exists(flights_file) else {}
+    bookings = legacy.load_bookings() if os.path.exists(bookings_file) else {}
+
+    with store.transaction() as conn:
+        # checked again under the write lock, shards starting together on a fresh
+        # database all get past the check above and only one of them may import
+        if (conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone()
+                or conn.execute("SELECT 1 FROM flights LIMIT 1").fetchone()
+                or conn.execute("SELECT 1 FROM bookings LIMIT 1").fetchone()):
+            return False
+        conn.executemany(
+            "INSERT INTO flights (flight_code, spots_left, data) VALUES (?, ?, ?)",
+            [store._flight_row(code, data) for code, data in flights.items()]
+        )
+        conn.executemany(
+            "INSERT INTO bookings (booking_code, flight_code, roblox_username, discord_id, cabin_class, booked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [store._booking_row(code, b) for code, passengers in bookings.items() for b in passengers]
+        )
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+            (json.dumps(datetime.utcnow().isoformat()),)
+        )
+
+    print(f"Migrated {len(flights)} flights and {sum(len(p) for p in bookings.values())} bookings into {store.path}")
+    return True
+
+
+def open_store():
+    if STORAGE_BACKEND == "json":
+        return JsonStore()
+
+    store = SQLiteStore()
+    migrate_json_to_sqlite(store)
+    return store
+
+
+class Histogram:
+    # fixed buckets like a prometheus histogram, quantiles are bucket upper bounds
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    # histograms and counters keyed by (name, labels), rendered in prometheus text format
+    def __init__(self, prefix="korean_air"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}  # name -> callable returning the current value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items())))) or Histogram()
+
+    def labelled(self, name):
+        return {labels: histogram for (metric, labels), histogram in self.histograms.items() if metric == name}
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def track_interaction(self, handler, elapsed, age, error=False):
+        # elapsed is the handler's own time, age is how long discord waited for the first response
+        self.observe("interaction_seconds", elapsed, handler=handler)
+        if error:
+            self.inc("interaction_errors_total", handler=handler)
+        if age >= INTERACTION_DEADLINE:
+            self.inc("interaction_deadline_missed_total", handler=handler)
+        elif age >= INTERACTION_DEADLINE_WARN:
+            self.inc("interaction_deadline_near_total", handler=handler)
+
+    def timed(self, handler):
+        # wraps a command or component callback, the signature is kept for app_commands
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                interaction = next((arg for arg in args if isinstance(arg, discord.Interaction)), None)
+                started = time.perf_counter()
+                error = False
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - started
+                    # discord's deadline runs from when it created the interaction to the first
+                    # response, gateway delay and the startup wait count, work after answering doesn't
+                    age = elapsed
+                    if interaction is not None:
+                        answered = interaction.extras.get("answered_at", discord.utils.utcnow())
+                        age = (answered - interaction.created_at).total_seconds()
+                    self.track_interaction(handler, elapsed, age, error)
+            return wrapper
+        return decorator
+
+    def render(self):
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for (metric, labels), value in self.counters.items():
+                if metric == name:
+                    lines.append(f"{self.prefix}_{name}{labels_text(labels)} {value}")
+
+        for name in sorted(self.gauges):
+            try:
+                value = self.gauges[name]()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+                continue
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+
+        names = sorted({name for name, _ in self.histograms})
+        for name in names:
+            lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for (metric, labels), histogram in self.histograms.items():
+                if metric != name:
+                    continue
+                seen = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    seen += count
+                    lines.append(f"{self.prefix}_{name}_bucket{labels_text(labels, [('le', bound)])} {seen}")
+                lines.append(f"{self.prefix}_{name}_bucket{labels_text(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{self.prefix}_{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{self.prefix}_{name}_count{labels_text(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def record_answer(respond):
+    # stamps the first response on the interaction, Metrics.timed counts deadlines up to it
+    @wraps(respond)
+    async def wrapper(self, *args, **kwargs):
+        result = await respond(self, *args, **kwargs)
+        self._parent.extras.setdefault("answered_at", discord.utils.utcnow())
+        return result
+    return wrapper
+
+
+for name in ("defer", "send_message", "edit_message", "send_modal", "autocomplete"):
+    setattr(discord.InteractionResponse, name, record_answer(getattr(discord.InteractionResponse, name)))
+
+
+class LoopMonitor:
+    # sleeps a fixed interval and measures how late it wakes up. a late wakeup means
+    # a callback held the loop, run with ASYNCIO_DEBUG=1 to have asyncio name it
+    def __init__(self, interval=LOOP_LAG_INTERVAL, warn=LOOP_LAG_WARN):
+        self.interval = interval
+        self.warn = warn
+        self.last_lag = 0.0
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.perf_counter() - started - self.interval)
+            metrics.observe("event_loop_lag_seconds", self.last_lag)
+            if self.last_lag >= self.warn:
+                metrics.inc("event_loop_stalls_total")
+                print(f"Event loop blocked for {self.last_lag * 1000:.0f}ms")
+
+
+class MetricsServer:
+    # prometheus scrape endpoint, bound to localhost only
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def handle(self, request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        if not self.port or self.runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+            print(f"Metrics on http://{self.host}:{self.port}/metrics")
+        except OSError as e:
+            print(f"Couldn't start metrics endpoint: {e}")
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+class TTLCache:
+    # LRU with a per-entry expiry, used for both valid and invalid usernames
+    def __init__(self, maxsize, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        self.entries[key] = (value, self.clock() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, reset_after=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        # half open, one request goes through to see if the api is back
+        if self.probing or self.clock() - self.opened_at < self.reset_after:
+            return False
+        self.probing = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            self.opened_at = self.clock()
+
+
+class RobloxValidator:
+    # one pooled session, cached answers, and usernames submitted within a few ms
+    # of each other go to roblox in a single request
+    def __init__(self, url=ROBLOX_USERS_URL):
+        self.url = url
+        self.session = None
+        self.cache = TTLCache(ROBLOX_CACHE_SIZE)
+        self.breaker = CircuitBreaker()
+        self.pending = {}  # lowercased username -> future
+        self.flush_handle = None
+        self.lookups = set()  # running lookups, the loop only keeps weak references
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=ROBLOX_TIMEOUT)
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def check(self, username):
+        if len(username) < 3 or len(username) > 20:
+            return False
+        
+        if not username.replace('_', '').isalnum():
+            return False
+
+        key = username.lower()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # if roblox is down we let people through, same as before
+        if not self.breaker.allow():
+            return True
+
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[key] = future
+            if len(self.pending) >= ROBLOX_BATCH_SIZE:
+                self.flush()
+            elif self.flush_handle is None:
+                self.flush_handle = asyncio.get_running_loop().call_later(ROBLOX_BATCH_WINDOW, self.flush)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), ROBLOX_TIMEOUT + ROBLOX_BATCH_WINDOW)
+        except asyncio.TimeoutError:
+            return True
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        batch, self.pending = self.pending, {}
+        if batch:
+            task = asyncio.ensure_future(self.lookup(batch))
+            self.lookups.add(task)
+            task.add_done_callback(self.lookups.discard)
+
+    async def lookup(self, batch):
+        found = None
+        started = time.perf_counter()
+        try:
+            async with self.get_session().post(
+                self.url,
+                json={"usernames": list(batch), "excludeBannedUsers": True}
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    found = {user.get('requestedUsername', '').lower() for user in data.get('data', [])}
+                else:
+                    print(f"Roblox API check failed: HTTP {response.status}")
+        except Exception as e:
+            print(f"Roblox API check failed: {e}")
+        metrics.observe("roblox_request_seconds", time.perf_counter() - started)
+        metrics.observe("roblox_batch_size", len(batch))
+
+        if found is None:
+            metrics.inc("roblox_errors_total")
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+        for key, future in batch.items():
+            if found is None:
+                result = True
+            else:
+                result = key in found
+                self.cache.set(key, result, ROBLOX_CACHE_TTL if result else ROBLOX_NEGATIVE_CACHE_TTL)
+            if not future.done():
+                future.set_result(result)
+
+
+class SeatInventory:
+    # every seat change goes through here, one lock per flight so a hold/commit
+    # can never interleave with another booking or a reload of the same flight
+    def __init__(self, bot):
+        self.bot = bot
+        self.locks = {}
+        self.holds = {}  # flight_code -> {hold_id: expires_at}
+        self.hold_flights = {}  # hold_id -> flight_code
+        self.committed = {}  # hold_id -> (booking_code, expires_at)
+
+    def lock(self, flight_code):
+        if flight_code not in self.locks:
+            self.locks[flight_code] = asyncio.Lock()
+        return self.locks[flight_code]
+
+    def expire(self, flight_code):
+        now = time.monotonic()
+        holds = self.holds.get(flight_code, {})
+        for hold_id in [h for h, expires_at in holds.items() if expires_at <= now]:
+            del holds[hold_id]
+            self.hold_flights.pop(hold_id, None)
+
+        for hold_id in [h for h, (_, expires_at) in self.committed.items() if expires_at <= now]:
+            del self.committed[hold_id]
+
+    def held(self, flight_code):
+        return len(self.holds.get(flight_code, {}))
+
+    def available(self, flight_code):
+        flight_data = self.bot.flights.get(flight_code)
+        if not flight_data:
+            return 0
+        self.expire(flight_code)
+        return flight_data['spots_left'] - self.held(flight_code)
+
+    async def hold(self, flight_code, hold_id=None, timeout=HOLD_TIMEOUT):
+        async with self.lock(flight_code):
+            self.expire(flight_code)
+            # the same flow run again after booking, commit will hand back that booking
+            if hold_id is not None and hold_id in self.committed:
+                return hold_id
+            
+            if hold_id is not None and hold_id in self.holds.get(flight_code, {}):
+                self.holds[flight_code][hold_id] = time.monotonic() + timeout
+                return hold_id
+
+            if self.available(flight_code) <= 0:
+                return None
+
+            hold_id = hold_id or secrets.token_hex(8)
+            self.holds.setdefault(flight_code, {})[hold_id] = time.monotonic() + timeout
+            self.hold_flights[hold_id] = flight_code
+            return hold_id
+
+    async def commit(self, hold_id, flight_code, roblox_username, discord_id, cabin_class):
+        # returns (booking_code, created), committing the same hold twice gives back the first booking
+        async with self.lock(flight_code):
+            if hold_id in self.committed:
+                # a hold taken again under a committed id mustn't keep a seat back
+                self.holds.get(flight_code, {}).pop(hold_id, None)
+                self.hold_flights.pop(hold_id, None)
+                return self.committed[hold_id][0], False
+
+            flight_data = self.bot.flights.get(flight_code)
+            if not flight_data:
+                return None, False
+
+            had_hold = self.holds.get(flight_code, {}).pop(hold_id, None) is not None
+            self.hold_flights.pop(hold_id, None)
+
+            # no hold and no record of committing it, e.g. the bot restarted in between.
+            # the same passenger already on this flight for the same user is that booking
+            if not had_hold:
+                for booking in self.bot.index.by_passenger.get((flight_code, roblox_username.lower()), {}).values():
+                    if booking.discord_id == discord_id:
+                        return booking.booking_code, False
+
+            # an expired hold can still book if a seat is free
+            if not had_hold and self.available(flight_code) <= 0:
+                return None, False
+
+            # the store has the final say, another process may have sold the seat
+            booking_code = self.bot.book_seat(flight_code, roblox_username, discord_id, cabin_class)
+            if not booking_code:
+                return None, False
+
+            self.committed[hold_id] = (booking_code, time.monotonic() + HOLD_TIMEOUT)
+            return booking_code, True
+
+    async def cancel(self, flight_code, booking_code):
+        # gives the seat back, False if the booking was already gone
+        async with self.lock(flight_code):
+            if not self.bot.cancel_booking(flight_code, booking_code):
+                return False
+
+            # the same flow booking again later shouldn't get the cancelled code back
+            for hold_id in [h for h, (code, _) in self.committed.items() if code == booking_code]:
+                del self.committed[hold_id]
+            return True
+
+    async def apply_flight_changes(self, changes, seen=None):
+        # changes is flight_code -> changed fields, or None when the flight was removed.
+        # applied in place so views holding client.flights keep seeing live data.
+        # seen is what memory held when the store was read, a seat sold since then is newer
+        seen = seen or {}
+        for flight_code, fields in changes.items():
+            async with self.lock(flight_code):
+                if fields is None:
+                    self.bot.flights.pop(flight_code, None)
+                elif flight_code in self.bot.flights:
+                    flight_data = self.bot.flights[flight_code]
+                    before = seen.get(flight_code)
+                    if 'spots_left' in fields and before is not None and flight_data['spots_left'] != before.get('spots_left'):
+                        fields = {k: v for k, v in fields.items() if k != 'spots_left'}
+                    flight_data.update(fields)
+                else:
+                    self.bot.flights[flight_code] = dict(fields)
+
+
+class FlightWatcher:
+    # reloads flights only when the store says someone else changed them,
+    # and only touches the flights/fields that actually differ
+    def __init__(self, bot, interval=FLIGHT_WATCH_INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self.token = bot.store.change_token()
+        self.snapshot = {code: dict(data) for code, data in bot.flights.items()}
+        self.reload_count = 0
+        self.last_reload_duration = 0.0
+        self.last_reload_changes = 0
+
+    def diff(self, flights, snapshot):
+        changes = {code: None for code in snapshot if code not in flights}
+
+        for flight_code, flight_data in flights.items():
+            old = snapshot.get(flight_code)
+            if old is None:
+                if flight_code in self.bot.flights:
+                    # added by us since the last reload, memory already has the seat count
+                    old = {'spots_left': flight_data.get('spots_left')}
+                else:
+                    changes[flight_code] = flight_data
+                    continue
+
+            # spots_left only counts if it moved on disk, so we never clobber
+            # seats sold in memory with the number we loaded last time
+            fields = {k: v for k, v in flight_data.items() if old.get(k) != v}
+            if fields:
+                changes[flight_code] = fields
+
+        return changes
+
+    def note_write(self, flight_code, flight_data):
+        # our own writes are already in memory, don't treat them as changes on disk
+        if flight_data is None:
+            self.snapshot.pop(flight_code, None)
+        else:
+            self.snapshot[flight_code] = dict(flight_data)
+
+    def note_seats(self, flight_code, spots_left):
+        if flight_code in self.snapshot:
+            self.snapshot[flight_code]['spots_left'] = spots_left
+
+    async def reload(self):
+        started = time.perf_counter()
+        # our own writes keep moving self.snapshot while the store is read off the loop,
+        # the read is compared with what we knew when it started
+        snapshot = {code: dict(data) for code, data in self.snapshot.items()}
+        try:
+            flights = await asyncio.to_thread(self.bot.store.read_flights)
+        except ValueError as e:
+            # caught the file mid-write, try again next tick
+            print(f"Error reloading flights: {e}")
+            self.token = None
+            return
+
+        changes = self.diff(flights, snapshot)
+        if changes:
+            await self.bot.inventory.apply_flight_changes(changes, snapshot)
+            self.bot.store.sync_flights(self.bot.flights)
+            self.bot.flights_changed(list(changes))
+
+        # flights we wrote during the read may be newer than what was read
+        written = {code: data for code, data in self.snapshot.items() if snapshot.get(code) != data}
+        self.snapshot = {code: written.get(code, data) for code, data in flights.items()}
+        await self.bot.sync_bookings()
+        self.reload_count += 1
+        self.last_reload_changes = len(changes)
+        self.last_reload_duration = time.perf_counter() - started
+        metrics.observe("flight_reload_seconds", self.last_reload_duration)
+
+    async def run(self):
+        while not self.bot.is_closed():
+            token = self.bot.store.change_token()
+            if token != self.token:
+                self.token = token
+                await self.reload()
+            await asyncio.sleep(self.interval)
+
+
+class BookingIndex:
+    # lookups by booking code, discord user and passenger without scanning every flight list.
+    # kept up to date by remember_booking/forget_booking, rebuilt once at load
+    def __init__(self):
+        self.by_code = {}  # booking_code -> (flight_code, booking)
+        self.by_discord = {}  # discord_id -> {booking_code: (flight_code, booking)}
+        self.by_passenger = {}  # (flight_code, roblox_username lowercased) -> {booking_code: booking}
+        self.cabin_counts = {}  # flight_code -> {CabinClass: count}
+
+    def rebuild(self, bookings):
+        self.__init__()
+        for flight_code, passengers in bookings.items():
+            for booking in passengers:
+                self.add(flight_code, booking)
+
+    def add(self, flight_code, booking):
+        booking_code = booking.booking_code
+        self.by_code[booking_code] = (flight_code, booking)
+        self.by_discord.setdefault(booking.discord_id, {})[booking_code] = (flight_code, booking)
+        self.by_passenger.setdefault((flight_code, booking.roblox_username.lower()), {})[booking_code] = booking
+
+        counts = self.cabin_counts.setdefault(flight_code, {})
+        counts[booking.cabin_class] = counts.get(booking.cabin_class, 0) + 1
+
+    def remove(self, booking_code):
+        entry = self.by_code.pop(booking_code, None)
+        if entry is None:
+            return None
+        flight_code, booking = entry
+
+        user_bookings = self.by_discord.get(booking.discord_id, {})
+        user_bookings.pop(booking_code, None)
+        if not user_bookings:
+            self.by_discord.pop(booking.discord_id, None)
+
+        key = (flight_code, booking.roblox_username.lower())
+        passenger_bookings = self.by_passenger.get(key, {})
+        passenger_bookings.pop(booking_code, None)
+        if not passenger_bookings:
+            self.by_passenger.pop(key, None)
+
+        counts = self.cabin_counts.get(flight_code, {})
+        counts[booking.cabin_class] = counts.get(booking.cabin_class, 1) - 1
+        if counts[booking.cabin_class] <= 0:
+            del counts[booking.cabin_class]
+
+        return entry
+
+    def get(self, booking_code):
+        return self.by_code.get(booking_code)
+
+    def for_user(self, discord_id):
+        return list(self.by_discord.get(discord_id, {}).values())
+
+    def passenger_booked(self, flight_code, roblox_username):
+        return (flight_code, roblox_username.lower()) in self.by_passenger
+
+    def passenger_count(self, flight_code):
+        return sum(self.cabin_counts.get(flight_code, {}).values())
+
+
+@lru_cache(maxsize=4096)
+def departure_timestamp(departure):
+    # departures are entered as UTC "YYYY-MM-DD HH:MM", None if it doesn't parse
+    try:
+        return int(datetime.strptime(departure, DEPARTURE_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def flight_timezone(name):
+    # None if it isn't an IANA name like Europe/London
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return None
+
+
+FLIGHT_CODE_PATTERN = re.compile(r"[A-Z0-9]{2,10}")
+REPEATS = {"daily": 1, "weekly": 7}
+
+
+def parse_flight_row(row, now=None):
+    # one imported row -> (flight_code, flight_data), or (flight_code, template) when it
+    # has a repeat column. raises ValueError saying what's wrong with it
+    if not isinstance(row, dict):
+        raise ValueError("expected an object with flight_code, route, aircraft, spots and departure")
+    row = {str(k).strip().lower(): v.strip() if isinstance(v, str) else v for k, v in row.items() if k is not None}
+    
+    flight_code = str(row.get('flight_code') or '').upper()
+    if not FLIGHT_CODE_PATTERN.fullmatch(flight_code):
+        raise ValueError(f"flight_code `{flight_code}` should be 2-10 letters and digits, e.g. AK5453")
+    
+    for field in ('route', 'aircraft'):
+        if not row.get(field) or len(str(row[field])) > 100:
+            raise ValueError(f"{flight_code}: {field} is missing or longer than 100 characters")
+    
+    try:
+        spots = int(row.get('spots'))
+    except (TypeError, ValueError):
+        raise ValueError(f"{flight_code}: spots should be a number")
+    if not 1 <= spots <= 1000:
+        raise ValueError(f"{flight_code}: spots should be between 1 and 1000")
+    
+    tz = row.get('timezone') or "Europe/London"
+    if flight_timezone(tz) is None:
+        raise ValueError(f"{flight_code}: unknown timezone `{tz}`, use a name like Europe/London")
+    
+    data = {"route": str(row['route']), "aircraft": str(row['aircraft']), "spots_left": spots, "capacity": spots, "timezone": tz}
+    
+    if row.get('repeat'):
+        return flight_code, parse_template(flight_code, row, data, now)
+    
+    ts = departure_timestamp(str(row.get('departure') or ''))
+    if ts is None:
+        raise ValueError(f"{flight_code}: departure should be UTC YYYY-MM-DD HH:MM")
+    if ts <= (now if now is not None else time.time()):
+        raise ValueError(f"{flight_code}: departure {row['departure']} is in the past")
+    data['departure'] = row['departure']
+    return flight_code, data
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
 
+def parse_template(flight_code, row, data, now=None):
+    # "AK5453 daily at 18:00 Europe/London for 30 days" is repeat=daily, time=18:00,
+    # timezone=Europe/London, days=30. time is local to the timezone, so it follows DST
+    repeat = str(row['repeat']).lower()
+    if repeat not in REPEATS:
+        raise ValueError(f"{flight_code}: repeat should be one of {', '.join(REPEATS)}")
+    
+    try:
+        departs_at = datetime.strptime(str(row.get('time') or ''), "%H:%M").strftime("%H:%M")
+    except ValueError:
+        raise ValueError(f"{flight_code}: time should be HH:MM in {data['timezone']}")
+    
+    today = datetime.fromtimestamp(now if now is not None else time.time(), flight_timezone(data['timezone'])).date()
+    try:
+        start = date.fromisoformat(str(row['start'])) if row.get('start') else today
+    except ValueError:
+        raise ValueError(f"{flight_code}: start should be YYYY-MM-DD")
+    
+    try:
+        days = int(row.get('days') or 30)
+    except (TypeError, ValueError):
+        raise ValueError(f"{flight_code}: days should be a number")
+    if not 1 <= days <= TEMPLATE_MAX_DAYS:
+        raise ValueError(f"{flight_code}: days should be between 1 and {TEMPLATE_MAX_DAYS}")
+    if start + timedelta(days=days) <= today:
+        raise ValueError(f"{flight_code}: the schedule has already ended")
+    
+    return dict(data, repeat=repeat, time=departs_at, start=start.isoformat(), days=days, next=start.isoformat())
+
+
+def flight_rows(data, file_format):
+    # yields (line, row) one at a time so a bad file is rejected at the first
+    # IMPORT_MAX_ERRORS problems without parsing the rest. jsonl rows come back
+    # as text and are decoded by the caller, so one bad line doesn't end the file
+    if file_format == "csv":
+        reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline=""))
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == "jsonl":
+        for line_number, line in enumerate(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig"), 1):
+            if line.strip():
+                yield line_number, line
+    else:
+        rows = json.loads(data)
+        if not isinstance(rows, list):
+            raise ValueError("a .json file should hold a list of flights")
+        for i, row in enumerate(rows, 1):
+            yield i, row
+
+
+def route_airports(route):
+    return [airport.strip().lower() for airport in route.replace('->', '→').split('→') if airport.strip()]
+
+
+class FlightIndex:
+    # sorted views over client.flights for the flight picker, rebuilt lazily after
+    # a flight is added, removed, rescheduled or rerouted. prebuilt option pages are
+    # cached per filter until then, a sale only re-renders that flight's option
+    def __init__(self, bot):
+        self.bot = bot
+        self.version = 0
+        self.built_version = -1
+        self.by_departure = []  # (departure_ts, flight_code), soonest first
+        self.unscheduled = []  # flights whose departure didn't parse
+        self.by_code = []  # sorted flight codes, for prefix search
+        self.by_airport = []  # sorted (airport, flight_code)
+        self.placed = {}  # flight_code -> (departure, route) the sorted views were built from
+        self.options = {}  # flight_code -> SelectOption, shared by every cached page
+        self.pages = TTLCache(64)
+
+    def placement(self, flight_code):
+        flight_data = self.bot.flights.get(flight_code)
+        if flight_data is None:
+            return None
+        return flight_data.get('departure'), flight_data.get('route', '')
+
+    def invalidate(self, flight_codes=None):
+        if flight_codes is not None and self.built_version == self.version:
+            if all(self.placement(code) == self.placed.get(code) for code in flight_codes):
+                for flight_code in flight_codes:
+                    if flight_code in self.options:
+                        self.render_option(flight_code, self.options[flight_code])
+                return
+
+        self.version += 1
+        self.options = {}
+        self.pages = TTLCache(64)
+
+    def build(self):
+        if self.built_version == self.version:
+            return
+
+        by_departure, unscheduled, by_airport = [], [], []
+        self.placed = {flight_code: self.placement(flight_code) for flight_code in self.bot.flights}
+        for flight_code, flight_data in self.bot.flights.items():
+            ts = departure_timestamp(flight_data.get('departure'))
+            if ts is None:
+                unscheduled.append(flight_code)
+            else:
+                by_departure.append((ts, flight_code))
+            for airport in route_airports(flight_data.get('route', '')):
+                by_airport.append((airport, flight_code))
+
+        self.by_departure = sorted(by_departure)
+        self.unscheduled = sorted(unscheduled)
+        self.by_code = sorted(self.bot.flights)
+        self.by_airport = sorted(by_airport)
+        self.built_version = self.version
+
+    def upcoming(self, route=None, within_hours=None, now=None):
+        self.build()
+        now = int(time.time()) if now is None else now
+
+        start = bisect.bisect_left(self.by_departure, (now, ''))
+        if within_hours is None:
+            codes = [code for _, code in self.by_departure[start:]] + self.unscheduled
+        else:
+            end = bisect.bisect_right(self.by_departure, (now + within_hours * 3600, '\uffff'))
+            codes = [code for _, code in self.by_departure[start:end]]
+
+        if route:
+            route = route.lower()
+            codes = [code for code in codes if route in self.bot.flights[code].get('route', '').lower()]
+        return codes
+
+    def option_pages(self, route=None, within_hours=None):
+        key = (route.lower() if route else None, within_hours)
+        pages = self.pages.get(key)
+        if pages is not None:
+            return pages
+
+        options = []
+        for flight_code in self.upcoming(route, within_hours):
+            if flight_code not in self.options:
+                self.options[flight_code] = self.render_option(flight_code, discord.SelectOption(label=flight_code, value=flight_code))
+            options.append(self.options[flight_code])
+
+        pages = [options[i:i + PICKER_PAGE_SIZE] for i in range(0, len(options), PICKER_PAGE_SIZE)]
+        self.pages.set(key, pages, PICKER_CACHE_TTL)
+        return pages
+
+    def render_option(self, flight_code, option):
+        flight_data = self.bot.flights[flight_code]
+        label = f"{flight_code} - {flight_data['route']}"
+        description = f"{flight_data['aircraft']} • {flight_data['spots_left']} spots • {flight_data['departure']}"
+        option.label = label[:100]
+        option.description = description[:100]
+        return option
+
+    def search(self, prefix, limit=25):
+        # flight codes starting with prefix, then flights with an airport starting with it
+        self.build()
+        results = []
+
+        code_prefix = prefix.upper()
+        i = bisect.bisect_left(self.by_code, code_prefix)
+        while i < len(self.by_code) and self.by_code[i].upper().startswith(code_prefix) and len(results) < limit:
+            results.append(self.by_code[i])
+            i += 1
+
+        airport_prefix = prefix.lower()
+        if airport_prefix:
+            i = bisect.bisect_left(self.by_airport, (airport_prefix, ''))
+            while i < len(self.by_airport) and self.by_airport[i][0].startswith(airport_prefix) and len(results) < limit:
+                if self.by_airport[i][1] not in results:
+                    results.append(self.by_airport[i][1])
+                i += 1
+
+        return results
+
+
+def flight_status(flight_data, now=None):
+    now = int(time.time()) if now is None else now
+    ts = departure_timestamp(flight_data.get('departure'))
+    if ts is None:
+        return "Scheduled"
+    if ts <= now:
+        return "Departed"
+    if ts - now <= BOARDING_REMINDER_BEFORE:
+        return "Boarding"
+    if flight_data['spots_left'] <= 0:
+        return "Full"
+    if ts - now <= CHECKIN_OPENS_BEFORE:
+        return "Check-in open"
+    return "Scheduled"
+
+
+class DepartureBoard:
+    # one pinned message per channel, edited in place. changes are debounced so a
+    # burst of bookings ends up as a single edit, and nothing is rendered or sent
+    # unless the rows on the board actually changed
+    def __init__(self, bot, channel_ids, get_channel=None, debounce=BOARD_DEBOUNCE,
+                 min_interval=BOARD_MIN_EDIT_INTERVAL, refresh=BOARD_REFRESH):
+        self.bot = bot
+        self.channel_ids = channel_ids
+        self.get_channel = get_channel or self.resolve_channel
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.refresh = refresh
+        self.dirty = asyncio.Event()
+        self.published = {}  # channel_id -> rows last sent there
+        self.last_edit = {}  # channel_id -> monotonic time of last edit
+        self.render_count = 0
+        self.edit_count = 0
+
+    def mark_dirty(self, flight_codes=None):
+        self.dirty.set()
+
+    def rows(self):
+        rows = []
+        for flight_code in self.bot.flight_index.upcoming()[:BOARD_ROWS]:
+            flight_data = self.bot.flights[flight_code]
+            passengers = self.bot.index.passenger_count(flight_code)
+            total_seats = self.bot.flight_capacity(flight_code)
+            rows.append((flight_code, flight_data['route'], flight_data['departure'],
+                         passengers, total_seats, flight_status(flight_data)))
+        return tuple(rows)
+
+    def render(self, rows):
+        self.render_count += 1
+        embed = discord.Embed(
+            title="🛫 Air Korea Departures",
+            description="Upcoming flights and availability" if rows else "No upcoming flights.",
+            color=0x0066CC,
+            timestamp=datetime.utcnow()
+        )
+        for flight_code, route, departure, passengers, total_seats, status in rows:
+            ts = departure_timestamp(departure)
+            time_display = f"<t:{ts}:t> (<t:{ts}:R>)" if ts else departure
+            embed.add_field(
+                name=f"✈️ {flight_code} • {status}",
+                value=f"**Route:** {route}\n"
+                      f"**Departure:** {time_display}\n"
+                      f"**Occupancy:** {passengers}/{total_seats} seats booked",
+                inline=False
+            )
+        embed.set_footer(text="Air Korea PTFS • Departure Board")
+        return embed
+
+    async def resolve_channel(self, channel_id):
+        return self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+
+    async def publish(self, channel_id, rows, embed):
+        wait = self.last_edit.get(channel_id, 0) + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        channel = await self.get_channel(channel_id)
+        message_id = self.bot.store.get_meta(f"board:{channel_id}")
+        self.last_edit[channel_id] = time.monotonic()
+        self.edit_count += 1
+
+        if message_id:
+            try:
+                await channel.get_partial_message(message_id).edit(embed=embed)
+                self.published[channel_id] = rows
+                return
+            except discord.NotFound:
+                pass
+
+        message = await channel.send(embed=embed)
+        try:
+            await message.pin()
+        except discord.HTTPException as e:
+            print(f"Couldn't pin departure board in {channel_id}: {e}")
+        self.bot.store.set_meta(f"board:{channel_id}", message.id)
+        self.published[channel_id] = rows
+
+    async def update(self):
+        rows = self.rows()
+        stale = [channel_id for channel_id in self.channel_ids if self.published.get(channel_id) != rows]
+        if not stale:
+            return
+
+        embed = self.render(rows)
+        for channel_id in stale:
+            try:
+                await self.publish(channel_id, rows, embed)
+            except discord.HTTPException as e:
+                print(f"Error updating departure board in {channel_id}: {e}")
+
+    async def run(self):
+        while not self.bot.is_closed():
+            await self.update()
+            try:
+                await asyncio.wait_for(self.dirty.wait(), self.refresh)
+                # let the rest of the burst land before we render
+                await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self.dirty.clear()
+
+
+class DMQueue:
+    # DMs go through a fixed pool of workers instead of being awaited inline.
+    # 429/5xx are retried with exponential backoff, users with DMs closed end up
+    # in a dead-letter list kept in the store
+    def __init__(self, bot, workers=DM_WORKERS):
+        self.bot = bot
+        self.worker_count = workers
+        self.queue = asyncio.Queue(maxsize=DM_QUEUE_SIZE)
+        self.workers = []
+        self.delivered = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)  # seconds from queued to delivered
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+        return {
+            "depth": self.depth(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dead_letters": len(self.bot.store.get_meta("dm:dead_letters", [])),
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+        }
+
+    async def put(self, user_id, on_dead=None, **message):
+        # on_dead is awaited with the reason if the DM can't be delivered
+        await self.queue.put((user_id, message, on_dead, time.monotonic()))
+
+    async def deliver(self, user_id, message):
+        user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+        await user.send(**message)
+
+    async def dead_letter(self, user_id, reason, on_dead):
+        self.failed += 1
+        print(f"Couldn't DM {user_id}: {reason}")
+        dead_letters = self.bot.store.get_meta("dm:dead_letters", [])
+        dead_letters.append({"discord_id": user_id, "reason": reason, "at": datetime.utcnow().isoformat()})
+        self.bot.store.set_meta("dm:dead_letters", dead_letters[-500:])
+
+        if on_dead is not None:
+            try:
+                await on_dead(reason)
+            except Exception as e:
+                print(f"Error reporting failed DM to {user_id}: {e}")
+
+    async def send(self, user_id, message, on_dead, queued_at):
+        for attempt in range(DM_MAX_ATTEMPTS):
+            try:
+                await self.deliver(user_id, message)
+            except discord.Forbidden:
+                await self.dead_letter(user_id, "dms_closed", on_dead)
+                return
+            except discord.NotFound:
+                await self.dead_letter(user_id, "unknown_user", on_dead)
+                return
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500:
+                    await self.dead_letter(user_id, f"http_{e.status}", on_dead)
+                    return
+                await asyncio.sleep(DM_RETRY_BASE * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            except Exception as e:
+                await self.dead_letter(user_id, str(e), on_dead)
+                return
+
+            self.delivered += 1
+            self.latencies.append(time.monotonic() - queued_at)
+            return
+
+        await self.dead_letter(user_id, "retries_exhausted", on_dead)
+
+    async def worker(self):
+        while True:
+            user_id, message, on_dead, queued_at = await self.queue.get()
+            try:
+                await self.send(user_id, message, on_dead, queued_at)
+            finally:
+                self.queue.task_done()
+
+
+class FlightScheduler:
+    # check-in, boarding reminders and archiving off one heap of (when, flight) entries.
+    # departures are parsed once when a flight is scheduled. entries for flights that
+    # were removed or rescheduled are left in the heap and skipped when they come up
+    EVENTS = (
+        ("checkin", -CHECKIN_OPENS_BEFORE),
+        ("boarding", -BOARDING_REMINDER_BEFORE),
+        ("archive", ARCHIVE_AFTER),
+    )
+
+    def __init__(self, bot, clock=time.time):
+        self.bot = bot
+        self.clock = clock
+        self.heap = []  # (when, seq, kind, flight_code, departure_ts)
+        self.seq = itertools.count()
+        self.scheduled = {}  # flight_code -> departure_ts its entries were made for
+        self.wakeup = asyncio.Event()
+        self.fired = 0
+
+    def schedule(self, flight_code):
+        flight_data = self.bot.flights.get(flight_code)
+        ts = departure_timestamp(flight_data.get('departure')) if flight_data else None
+        if ts is None:
+            self.scheduled.pop(flight_code, None)
+            return
+        if self.scheduled.get(flight_code) == ts:
+            return
+
+        self.scheduled[flight_code] = ts
+        for kind, offset in self.EVENTS:
+            heapq.heappush(self.heap, (ts + offset, next(self.seq), kind, flight_code, ts))
+        self.wakeup.set()
+
+    def flights_changed(self, flight_codes=None):
+        for flight_code in flight_codes if flight_codes is not None else list(self.bot.flights):
+            self.schedule(flight_code)
+
+    def done_key(self, flight_code, kind, ts):
+        return f"{flight_code}:{kind}:{ts}"
+
+    async def run_due(self):
+        now = self.clock()
+        while self.heap and self.heap[0][0] <= now:
+            when, _, kind, flight_code, ts = heapq.heappop(self.heap)
+            if self.scheduled.get(flight_code) != ts:
+                continue
+
+            # marked done before sending, so a restart mid-send never DMs anyone twice
+            done = self.bot.store.get_meta("scheduler:done", [])
+            key = self.done_key(flight_code, kind, ts)
+            if key in done:
+                continue
+            done.append(key)
+            self.bot.store.set_meta("scheduler:done", done[-1000:])
+
+            self.fired += 1
+            if kind == "archive":
+                self.bot.archive_flight(flight_code)
+            elif now < ts:
+                # don't send reminders for a flight that already left while we were down
+                await self.remind(flight_code, kind, ts)
+
+    async def remind(self, flight_code, kind, ts):
+        flight_data = self.bot.flights[flight_code]
+        if kind == "checkin":
+            title = "🛂 Check-in Now Open"
+            description = f"Check-in for **Flight {flight_code}** is now open."
+        else:
+            title = "🛫 Boarding Reminder"
+            description = f"**Flight {flight_code}** is boarding soon, please make your way to the gate."
+
+        embed = discord.Embed(title=title, description=description, color=0x0066CC)
+        embed.add_field(name="🛫 Route", value=flight_data['route'], inline=True)
+        embed.add_field(name="🕐 Departure Time", value=f"<t:{ts}:F> (<t:{ts}:R>)", inline=True)
+        embed.set_footer(text="Air Korea PTFS • Please arrive 30 minutes before departure")
+
+        for discord_id in {b.discord_id for b in self.bot.bookings.get(flight_code, [])}:
+            await self.bot.dms.put(discord_id, embed=embed)
+
+    async def run(self):
+        self.flights_changed()
+        while not self.bot.is_closed():
+            self.wakeup.clear()
+            await self.run_due()
+            timeout = 60
+            if self.heap:
+                timeout = max(0, min(timeout, self.heap[0][0] - self.clock()))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class Waitlist:
+    # passengers waiting on a full flight, first come first served. a freed seat
+    # goes through the same hold/commit as any other booking, so promoting
+    # someone can never oversell the flight
+    def __init__(self, bot, interval=WAITLIST_SWEEP):
+        self.bot = bot
+        self.interval = interval
+        self.promoted = 0
+
+    def join(self, flight_code, booker_id, roblox_username, discord_id, cabin_class):
+        # returns the place in line, joining twice keeps the first place
+        entries = self.bot.store.waitlist(flight_code)
+        for position, entry in enumerate(entries, 1):
+            if entry['discord_id'] == discord_id and entry['roblox_username'].lower() == roblox_username.lower():
+                return position
+
+        self.bot.store.join_waitlist(flight_code, {
+            'discord_id': discord_id,
+            'booker_id': booker_id,
+            'roblox_username': roblox_username,
+            'cabin_class': cabin_class,
+            'joined_at': datetime.utcnow().isoformat(),
+        })
+        return len(entries) + 1
+
+    async def promote(self, flight_code):
+        # fills free seats from the front of the line, returns how many got one
+        promoted = 0
+        while self.bot.inventory.available(flight_code) > 0:
+            entry = self.bot.store.pop_waitlist(flight_code)
+            if entry is None:
+                break
+            if self.bot.index.passenger_booked(flight_code, entry['roblox_username']):
+                continue
+
+            passenger_id = entry['discord_id'] if entry['discord_id'] != entry['booker_id'] else None
+            hold_id = await self.bot.inventory.hold(
+                flight_code, booking_hold_id(flight_code, entry['booker_id'], entry['roblox_username'], passenger_id)
+            )
+            booking_code = None
+            if hold_id:
+                booking_code, _ = await self.bot.inventory.commit(
+                    hold_id, flight_code, entry['roblox_username'], entry['discord_id'], entry['cabin_class']
+                )
+            if not booking_code:
+                # someone got to the seat first, keep their place for the next one
+                self.bot.store.restore_waitlist(flight_code, entry)
+                break
+
+            promoted += 1
+            await self.bot.store.barrier()
+            await self.notify_promoted(flight_code, entry, booking_code)
+
+        self.promoted += promoted
+        return promoted
+
+    async def notify_promoted(self, flight_code, entry, booking_code):
+        flight_data = self.bot.flights.get(flight_code, {})
+        ts = departure_timestamp(flight_data.get('departure'))
+
+        embed = discord.Embed(
+            title="🎉 You're Off the Waitlist",
+            description=f"A seat opened up on **Flight {flight_code}** and it's been booked for you.",
+            color=0x0066CC
+        )
+        embed.add_field(name="🛫 Route", value=flight_data.get('route', 'N/A'), inline=True)
+        embed.add_field(name="🕐 Departure Time", value=f"<t:{ts}:F>" if ts else flight_data.get('departure', 'N/A'), inline=True)
+        embed.add_field(name="💳 Booking Code", value=f"```{booking_code}```", inline=False)
+        embed.add_field(name="👤 Passenger (Roblox)", value=f"`{entry['roblox_username']}`", inline=True)
+        embed.add_field(name="💺 Cabin Class", value=entry['cabin_class'], inline=True)
+        embed.set_footer(text="Air Korea PTFS • Please arrive 30 minutes before departure")
+
+        for discord_id in {entry['discord_id'], entry['booker_id']}:
+            await self.bot.dms.put(discord_id, embed=embed)
+
+    async def notify_cancelled(self, flight_code, flight_data, passengers, waiting):
+        # one DM per user however many of their bookings were on the flight
+        by_user = {}
+        for booking in passengers:
+            by_user.setdefault(booking.discord_id, []).append(booking)
+
+        for discord_id, bookings in by_user.items():
+            embed = discord.Embed(
+                title="❌ Flight Cancelled",
+                description=f"**Flight {flight_code}** ({flight_data['route']}) has been cancelled, "
+                            f"along with {'your booking' if len(bookings) == 1 else f'your {len(bookings)} bookings'} on it.",
+                color=0x0066CC
+            )
+            lines = "\n".join(f"`{b.booking_code}` - `{b.roblox_username}`" for b in bookings)
+            embed.add_field(name="💳 Cancelled Bookings", value=lines[:EMBED_FIELD_LIMIT], inline=False)
+            embed.set_footer(text="Air Korea PTFS • We're sorry for the inconvenience")
+            await self.bot.dms.put(discord_id, embed=embed)
+
+        for discord_id in {entry['discord_id'] for entry in waiting} - set(by_user):
+            embed = discord.Embed(
+                title="❌ Flight Cancelled",
+                description=f"**Flight {flight_code}** ({flight_data['route']}) has been cancelled, so you've been taken off its waitlist.",
+                color=0x0066CC
+            )
+            embed.set_footer(text="Air Korea PTFS • We're sorry for the inconvenience")
+            await self.bot.dms.put(discord_id, embed=embed)
+
+    async def run(self):
+        # seats can also free up from an admin edit or another process, this catches those
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.interval)
+            try:
+                flight_codes = await asyncio.to_thread(self.bot.store.waitlisted_flights)
+                for flight_code in flight_codes:
+                    if flight_code in self.bot.flights:
+                        await self.promote(flight_code)
+            except Exception as e:
+                print(f"Error promoting waitlist: {e}")
+
+
+class FlightTemplates:
+    # recurring flights live as templates in meta and are only turned into real
+    # flights once they're within TEMPLATE_HORIZON, so a 30 day daily schedule is a
+    # week of flights at any time. each template keeps the next local date to create
+    def __init__(self, bot, horizon=TEMPLATE_HORIZON, interval=TEMPLATE_INTERVAL, clock=time.time):
+        self.bot = bot
+        self.horizon = horizon
+        self.interval = interval
+        self.clock = clock
+
+    def all(self):
+        return self.bot.store.get_meta("flight_templates", {})
+
+    def add(self, templates):
+        # replaces templates with the same code, returns the flights created straight away
+        merged = dict(self.all())
+        merged.update(templates)
+        self.bot.store.set_meta("flight_templates", merged)
+        return self.expand()
+
+    def remove(self, flight_code):
+        templates = dict(self.all())
+        if templates.pop(flight_code, None) is None:
+            return False
+        self.bot.store.set_meta("flight_templates", templates)
+        return True
+
+    def departures(self, template, until):
+        # (local date, UTC departure) from the template's next date up to until
+        tz = flight_timezone(template['timezone'])
+        hour, minute = map(int, template['time'].split(":"))
+        end = date.fromisoformat(template['start']) + timedelta(days=template['days'])
+        day = date.fromisoformat(template['next'])
+        while day < end:
+            departs = datetime(day.year, day.month, day.day, hour, minute, tzinfo=tz).astimezone(timezone.utc)
+            if departs.timestamp() > until:
+                break
+            yield day, departs
+            day += timedelta(days=REPEATS[template['repeat']])
 
-class FlightBot(discord.Client):
+    def expand(self):
+        # creates whatever has come within the horizon in one store write and
+        # drops templates that have run out, returns the codes created
+        now = self.clock()
+        templates = {code: dict(template) for code, template in self.all().items()}
+        flights = {}
+        
+        for template_code, template in list(templates.items()):
+            for day, departs in self.departures(template, now + self.horizon):
+                template['next'] = (day + timedelta(days=REPEATS[template['repeat']])).isoformat()
+                flight_code = f"{template_code}-{day:%y%m%d}"
+                if departs.timestamp() <= now or flight_code in self.bot.flights:
+                    continue
+                flights[flight_code] = {
+                    "route": template['route'],
+                    "aircraft": template['aircraft'],
+                    "spots_left": template['spots_left'],
+                    "capacity": template['capacity'],
+                    "departure": departs.strftime(DEPARTURE_FORMAT),
+                    "timezone": template['timezone'],
+                    "template": template_code,
+                }
+            
+            end = date.fromisoformat(template['start']) + timedelta(days=template['days'])
+            if date.fromisoformat(template['next']) >= end:
+                del templates[template_code]
+        
+        added = self.bot.add_flights(flights) if flights else []
+        if templates != self.all():
+            self.bot.store.set_meta("flight_templates", templates)
+        return added
+
+    async def run(self):
+        while not self.bot.is_closed():
+            try:
+                added = self.expand()
+                if added:
+                    print(f"Created {len(added)} recurring flights")
+            except Exception as e:
+                print(f"Error expanding flight templates: {e}")
+            await asyncio.sleep(self.interval)
+
+
+class BookingStats:
+    # bookings per minute for the last day in a fixed ring of buckets, so rolling
+    # windows never go back to the booking lists
+    def __init__(self, buckets=STATS_BUCKETS, bucket_seconds=STATS_BUCKET_SECONDS, clock=time.time):
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        self.counts = [0] * buckets
+        self.stamps = [-1] * buckets  # which bucket number each slot currently holds
+
+    def rebuild(self, bookings):
+        since = self.clock() - len(self.counts) * self.bucket_seconds
+        for passengers in bookings.values():
+            for booking in passengers:
+                ts = booking.timestamp()
+                if ts is not None and ts >= since:
+                    self.record(ts)
+
+    def record(self, ts=None):
+        bucket = int((self.clock() if ts is None else ts) // self.bucket_seconds)
+        slot = bucket % len(self.counts)
+        if self.stamps[slot] != bucket:
+            self.stamps[slot] = bucket
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def count(self, window):
+        now = int(self.clock() // self.bucket_seconds)
+        first = now - window // self.bucket_seconds + 1
+        return sum(count for count, bucket in zip(self.counts, self.stamps) if first <= bucket <= now)
+
+
+class BookingCodeGenerator:
+    # AKnnnnn-XXXXXX drawn from secrets, so codes can't be guessed from earlier ones.
+    # one randbelow over the whole 90000 * 26^6 space, retried on the rare clash
+    # with a code we've already handed out
+    LETTER_SPACE = 26 ** 6
+
+    def __init__(self, issued=()):
+        self.issued = set(issued)
+
+    def format(self, n):
+        number, rest = divmod(n, self.LETTER_SPACE)
+        letters = []
+        for _ in range(6):
+            rest, i = divmod(rest, 26)
+            letters.append(string.ascii_uppercase[i])
+        return f"AK{10000 + number}-{''.join(letters)}"
+
+    def generate(self):
+        while True:
+            code = self.format(secrets.randbelow(90000 * self.LETTER_SPACE))
+            if code not in self.issued:
+                self.issued.add(code)
+                return code
+
+
+class FlightCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await self.client.wait_until_loaded(interaction)
+
+
+class FlightBot(discord.AutoShardedClient):
     def __init__(self):
-        super().__init__(intents=intents)
-        self.tree = app_commands.CommandTree(self)
+        super().__init__(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+        self.tree = FlightCommandTree(self)
+        self.started = time.perf_counter()
+        self.loaded = asyncio.Event()
+        self.tasks_started = False
+        # filled in by load_state, which runs while the gateway connects
+        self.store = None
+        self.flights = {}
+        self.booking_cursor = None
+        self.bookings = {}
+        self.index = BookingIndex()
+        self.stats = BookingStats()
+        self.codes = BookingCodeGenerator()
+        self.watcher = None
+        self.inventory = SeatInventory(self)
+        self.roblox = RobloxValidator()
+        self.flight_index = FlightIndex(self)
+        self.board = DepartureBoard(self, DEPARTURE_BOARD_CHANNELS)
+        self.dms = DMQueue(self)
+        self.scheduler = FlightScheduler(self)
+        self.waitlist = Waitlist(self)
+        self.templates = FlightTemplates(self)
+        self.flight_listeners = [self.flight_index.invalidate, self.board.mark_dirty, self.scheduler.flights_changed]
+        self.loop_monitor = LoopMonitor()
+        self.metrics_server = MetricsServer(port=METRICS_PORT + min(SHARD_IDS) if METRICS_PORT and SHARD_IDS else METRICS_PORT)
+        metrics.gauge("flights", lambda: len(self.flights))
+        metrics.gauge("bookings", lambda: len(self.index.by_code))
+        metrics.gauge("seat_holds", lambda: len(self.inventory.hold_flights))
+        metrics.gauge("dm_queue_depth", self.dms.depth)
+        metrics.gauge("dm_delivered", lambda: self.dms.delivered)
+        metrics.gauge("dm_failed", lambda: self.dms.failed)
+        metrics.gauge("event_loop_lag_last_seconds", lambda: self.loop_monitor.last_lag)
+
+    def phase(self, name, detail=""):
+        elapsed = time.perf_counter() - self.started
+        metrics.observe("startup_seconds", elapsed, phase=name)
+        print(f"Startup: {name} at {elapsed:.2f}s {detail}".rstrip())
+
+    def load_state(self):
+        # the slow part of startup, reading every flight and booking
+        self.store = open_store()
         self.flights = self.load_flights()
+        self.booking_cursor = self.store.booking_cursor()
         self.bookings = self.load_bookings()
+        self.index.rebuild(self.bookings)
+        self.stats.rebuild(self.bookings)
+        self.backfill_capacity()
+        self.codes = BookingCodeGenerator(self.index.by_code)
+        self.watcher = FlightWatcher(self)
+
+    async def load(self):
+        try:
+            await asyncio.to_thread(self.load_state)
+        except Exception as e:
+            print(f"Error loading flights and bookings: {e}")
+            await self.close()
+            raise
         
-    def load_flights(self):
+        self.flights_changed()
+        self.loaded.set()
+        self.phase("state loaded", f"({len(self.flights)} flights, {len(self.index.by_code)} bookings)")
+
+    async def wait_until_loaded(self, interaction: discord.Interaction):
+        # interactions that arrive before the stores are loaded wait for them, but
+        # not past discord's deadline, after that they're told to try again
+        if self.loaded.is_set():
+            return True
         try:
-            with open(FLIGHTS_FILE, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"Warning: {FLIGHTS_FILE} not found, starting with empty flight list")
-            return {}
+            await asyncio.wait_for(self.loaded.wait(), STATE_LOAD_WAIT)
+            return True
+        except asyncio.TimeoutError:
+            metrics.inc("interactions_not_ready_total")
+            if interaction.type is not discord.InteractionType.autocomplete:
+                await interaction.response.send_message("⏳ The bot is still starting up, please try again in a few seconds.", ephemeral=True)
+            return False
+
+    def command_hash(self, guild=None):
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+                         key=lambda command: command['name'])
+        return hashlib.sha256(json.dumps([self.application_id, payload], sort_keys=True).encode()).hexdigest()
+
+    async def sync_commands(self):
+        # syncing is a slow, rate limited REST call, so it only happens when the
+        # commands differ from the last sync. with COMMAND_GUILDS set the commands
+        # go to those guilds, which also updates them straight away, and the
+        # global list is emptied once so nothing shows up twice
+        for guild_id in COMMAND_GUILDS:
+            self.tree.copy_global_to(guild=discord.Object(id=guild_id))
+        if COMMAND_GUILDS:
+            self.tree.clear_commands(guild=None)
+        
+        for guild_id in COMMAND_GUILDS + [None]:
+            guild = discord.Object(id=guild_id) if guild_id else None
+            key = f"commands:hash:{guild_id or 'global'}"
+            digest = self.command_hash(guild)
+            if self.store.get_meta(key) == digest:
+                continue
+            
+            try:
+                await self.tree.sync(guild=guild)
+            except discord.HTTPException as e:
+                print(f"Error syncing commands to {guild_id or 'global'}: {e}")
+                continue
+            self.store.set_meta(key, digest)
+            self.phase("commands synced", f"({guild_id or 'global'})")
+
+    async def setup_hook(self):
+        # stores load in the background while the gateway connects
+        asyncio.create_task(self.load())
+        
+        # booking flow components carry their state in custom_id, so clicks on
+        # messages sent before a restart still land here
+        self.add_dynamic_items(FlightPageButton, FlightSelectMenu, BookingTypeButton, CabinButton, WaitlistButton)
+        
+        if ASYNCIO_DEBUG:
+            # logs every callback that holds the loop longer than SLOW_CALLBACK_DURATION
+            loop = asyncio.get_running_loop()
+            loop.set_debug(True)
+            loop.slow_callback_duration = SLOW_CALLBACK_DURATION
+        
+        asyncio.create_task(self.loop_monitor.run())
+        await self.metrics_server.start()
+
+    async def close(self):
+        await self.metrics_server.close()
+        await self.roblox.close()
+        await super().close()
+        # whatever the writer hasn't flushed yet goes to disk before we exit
+        if self.store is not None:
+            await asyncio.to_thread(self.store.close)
+        
+    def load_flights(self):
+        return self.store.load_flights()
     
-    def save_flights(self):
-        with open(FLIGHTS_FILE, 'w') as f:
-            json.dump(self.flights, f, indent=4)
+    def save_flight(self, flight_code):
+        with metrics.timer("store_write_seconds", op="save_flight"):
+            self.store.save_flight(flight_code, self.flights[flight_code])
+        self.watcher.note_write(flight_code, self.flights[flight_code])
+        self.flights_changed([flight_code])
+
+    def add_flights(self, flights):
+        # new flights only, all in one store write. returns the codes added,
+        # any another process created first are skipped
+        with metrics.timer("store_write_seconds", op="add_flights"):
+            added = self.store.add_flights(flights)
+        for flight_code in added:
+            self.flights[flight_code] = flights[flight_code]
+            self.watcher.note_write(flight_code, flights[flight_code])
+        if added:
+            self.flights_changed(added)
+        return added
+
+    def delete_flight(self, flight_code):
+        # the flight's bookings and waitlist go with it, returned so the passengers can be told
+        del self.flights[flight_code]
+        passengers = list(self.bookings.get(flight_code, []))
+        waiting = self.store.waitlist(flight_code)
+        with metrics.timer("store_write_seconds", op="delete_flight"):
+            self.store.delete_flight(flight_code, with_bookings=True)
+        for booking in passengers:
+            self.forget_booking(booking.booking_code)
+        self.watcher.note_write(flight_code, None)
+        self.flights_changed([flight_code])
+        return passengers, waiting
+
+    def archive_flight(self, flight_code):
+        flight_data = self.flights.pop(flight_code, None)
+        if flight_data is None:
+            return
+        self.store.archive_flight(flight_code, flight_data)
+        self.watcher.note_write(flight_code, None)
+        self.flights_changed([flight_code])
+
+    def backfill_capacity(self):
+        # flights from before capacity was stored, what's sold plus what's left
+        for flight_code, flight_data in self.flights.items():
+            if 'capacity' not in flight_data:
+                flight_data['capacity'] = self.index.passenger_count(flight_code) + flight_data['spots_left']
+                self.store.save_flight_info(flight_code, flight_data)
+
+    def flight_capacity(self, flight_code):
+        flight_data = self.flights[flight_code]
+        return flight_data.get('capacity', self.index.passenger_count(flight_code) + flight_data['spots_left'])
+
+    def flights_changed(self, flight_codes=None):
+        for listener in self.flight_listeners:
+            listener(flight_codes)
     
     def load_bookings(self):
-        try:
-            with open(BOOKINGS_FILE, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"Warning: {BOOKINGS_FILE} not found, starting with empty bookings")
-            return {}
+        return self.store.load_bookings()
     
-    def save_bookings(self):
-        with open(BOOKINGS_FILE, 'w') as f:
-            json.dump(self.bookings, f, indent=4)
+    def new_booking(self, booking_code, roblox_username, discord_id, cabin_class):
+        return Booking(booking_code, roblox_username, discord_id, CabinClass.parse(cabin_class),
+                       parse_booked_at(datetime.utcnow().isoformat()))
     
-    def add_booking(self, flight_code, booking_code, roblox_username, discord_id, cabin_class):
+    def remember_booking(self, flight_code, booking_info):
         if flight_code not in self.bookings:
             self.bookings[flight_code] = []
         
-        booking_info = {
-            "booking_code": booking_code,
-            "roblox_username": roblox_username,
-            "discord_id": discord_id,
-            "cabin_class": cabin_class,
-            "booked_at": datetime.utcnow().isoformat()
-        }
-        
         self.bookings[flight_code].append(booking_info)
-        self.save_bookings()
+        self.index.add(flight_code, booking_info)
+        self.stats.record()
+    
+    def book_seat(self, flight_code, roblox_username, discord_id, cabin_class):
+        # one store transaction takes the seat and writes the booking
+        while True:
+            booking_info = self.new_booking(self.generate_booking_code(), roblox_username, discord_id, cabin_class)
+            try:
+                with metrics.timer("store_write_seconds", op="book_seat"):
+                    spots_left = self.store.book_seat(flight_code, booking_info)
+                break
+            except BookingCodeTaken:
+                continue
+        
+        flight_data = self.flights[flight_code]
+        flight_data['spots_left'] = spots_left if spots_left is not None else 0
+        self.watcher.note_seats(flight_code, flight_data['spots_left'])
+        self.flights_changed([flight_code])
+        
+        if spots_left is None:
+            return None
+        
+        self.remember_booking(flight_code, booking_info)
+        return booking_info.booking_code
+    
+    def forget_booking(self, booking_code):
+        entry = self.index.remove(booking_code)
+        if entry is None:
+            return None
+        
+        flight_code, booking = entry
+        passengers = self.bookings.get(flight_code, [])
+        for i, b in enumerate(passengers):
+            if b is booking:
+                del passengers[i]
+                break
+        if not passengers:
+            self.bookings.pop(flight_code, None)
+        return entry
+    
+    def cancel_booking(self, flight_code, booking_code):
+        # one store transaction drops the booking and gives the seat back
+        with metrics.timer("store_write_seconds", op="cancel_booking"):
+            spots_left = self.store.cancel_booking(flight_code, booking_code)
+        if spots_left is None:
+            return False
+        
+        self.forget_booking(booking_code)
+        flight_data = self.flights.get(flight_code)
+        if flight_data is not None:
+            flight_data['spots_left'] = spots_left
+            self.watcher.note_seats(flight_code, spots_left)
+            self.flights_changed([flight_code])
+        return True
+    
+    async def sync_bookings(self):
+        # pick up bookings made or cancelled by other processes on the same store
+        if self.booking_cursor is None:
+            return
+        added, removed, self.booking_cursor = await asyncio.to_thread(self.store.booking_changes, self.booking_cursor)
+        for flight_code, booking_info in added:
+            if booking_info.booking_code not in self.index.by_code:
+                self.remember_booking(flight_code, booking_info)
+                self.codes.issued.add(booking_info.booking_code)
+        for booking_code in removed:
+            self.forget_booking(booking_code)
     
     def generate_booking_code(self):
-        flight_num = random.randint(10000, 99999)
-        letters = ''.join(random.choices(string.ascii_uppercase, k=6))
-        return f"AK{flight_num}-{letters}"
+        return self.codes.generate()
 
 
 client = FlightBot()
 
 
-async def check_roblox_username(username: str) -> bool:
-    
-    if len(username) < 3 or len(username) > 20:
-        return False
-    
-    if not username.replace('_', '').isalnum():
-        return False
-    
-    # if fail it ignores lol
-    try:     
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://users.roblox.com/v1/usernames/users',
-                json={"usernames": [username], "excludeBannedUsers": True}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return len(data.get('data', [])) > 0
-    except Exception as e:
-        print(f"Roblox API check failed: {e}")
-        pass
+async def check_roblox_username(bot, username: str) -> bool:
+    return await bot.roblox.check(username)
+
+
+UNBOOKABLE_CODE = "❌ This flight's code is too long to book. Please ask an admin to re-add it with a shorter code."
+
+
+def booking_confirm_embed(flight_code, flight_data):
+    embed = discord.Embed(
+        title="🎫 Confirm Your Booking",
+        description=f"**Flight:** {flight_code}\n**Route:** {flight_data['route']}\n**Aircraft:** {flight_data['aircraft']}",
+        color=0x0066CC
+    )
+    embed.add_field(name="👤 Who is flying?", value="Please select who this booking is for:", inline=False)
+    embed.set_footer(text="Air Korea PTFS")
+    return embed
+
+
+def flight_key(flight_code):
+    # flight codes go into custom_ids percent-encoded, so a ':' in an older code can't split the id
+    return quote(flight_code, safe="")
+
+
+def bookable_code(flight_code):
+    return len(flight_key(flight_code)) <= FLIGHT_KEY_LIMIT
+
+
+def checked_custom_id(custom_id):
+    if len(custom_id) > CUSTOM_ID_LIMIT:
+        raise ValueError(f"custom_id too long: {custom_id}")
+    return custom_id
+
+
+def booking_hold_id(flight_code, booker_id, roblox_username, passenger_id):
+    # the same flow always maps to the same hold, before and after a restart
+    return f"{flight_code}:{booker_id}:{passenger_id or 0}:{roblox_username.lower()}"
+
+
+class StatelessView(View):
+    # every item is a DynamicItem that rebuilds its state from custom_id, so the
+    # view is stopped straight away and never kept in memory after it's sent
+    def __init__(self):
+        super().__init__(timeout=None)
     
-    return True
+    def seal(self):
+        self.stop()
+        return self
 
 
-class FlightSelectView(View):
-    def __init__(self, flights, user_id):
-        super().__init__(timeout=300)
+class LoadedItem:
+    # mixed into the DynamicItems, a click that comes in mid-startup waits for the stores
+    async def interaction_check(self, interaction: discord.Interaction):
+        return await interaction.client.wait_until_loaded(interaction)
+
+
+class FlightPageButton(LoadedItem, discord.ui.DynamicItem[Button], template=r'ak:fp:(?P<user>\d+):(?P<page>\d+):(?P<hours>\d*):(?P<route>.*)'):
+    def __init__(self, user_id, page, within_hours=None, route=None, label="Next", emoji="▶️", disabled=False):
+        super().__init__(Button(
+            label=label,
+            emoji=emoji,
+            style=discord.ButtonStyle.secondary,
+            disabled=disabled,
+            custom_id=checked_custom_id(f"ak:fp:{user_id}:{page}:{within_hours or ''}:{route or ''}")
+        ))
         self.user_id = user_id
-        self.selected_flight = None
-        
-        options = []
-        for flight_code, flight_data in flights.items():
-            label = f"{flight_code} - {flight_data['route']}"
-            description = f"{flight_data['aircraft']} • {flight_data['spots_left']} spots"
-            
-            options.append(discord.SelectOption(
-                label=label[:100],
-                value=flight_code,
-                description=description[:100]
-            ))
-        
-        if options:
-            select = Select(
-                placeholder="✈️ Select your flight",
-                options=options[:25]
-            )
-            select.callback = self.flight_selected
-            self.add_item(select)
+        self.page = page
+        self.within_hours = within_hours
+        self.route = route
+    
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(int(match['user']), int(match['page']), int(match['hours']) if match['hours'] else None, match['route'] or None)
     
-    async def flight_selected(self, interaction: discord.Interaction):
+    @metrics.timed("flight_page")
+    async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("This isn't your booking!", ephemeral=True)
             return
         
-        self.selected_flight = interaction.data['values'][0]
+        view = FlightSelectView(interaction.client, self.user_id, self.route, self.within_hours, self.page)
+        await interaction.response.edit_message(view=view.seal())
+
+
+class FlightSelectMenu(LoadedItem, discord.ui.DynamicItem[Select], template=r'ak:fs:(?P<user>\d+)'):
+    def __init__(self, user_id, options=None):
+        super().__init__(Select(
+            placeholder="✈️ Select your flight",
+            options=options or [discord.SelectOption(label="-")],
+            custom_id=f"ak:fs:{user_id}"
+        ))
+        self.user_id = user_id
+    
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Select, match):
+        return cls(int(match['user']), item.options)
+    
+    @metrics.timed("flight_select")
+    async def callback(self, interaction: discord.Interaction):
+        await flight_selected(interaction.client, interaction, self.user_id, interaction.data['values'][0])
+
+
+class FlightSelectView(StatelessView):
+    def __init__(self, bot, user_id, route=None, within_hours=None, page=0):
+        super().__init__()
         
-        view = BookingTypeView(self.selected_flight, self.user_id)
-        flight_data = client.flights[self.selected_flight]
+        pages = bot.flight_index.option_pages(route, within_hours)
+        self.page_count = len(pages)
+        self.page = max(0, min(page, self.page_count - 1))
         
-        embed = discord.Embed(
-            title="🎫 Confirm Your Booking",
-            description=f"**Flight:** {self.selected_flight}\n**Route:** {flight_data['route']}\n**Aircraft:** {flight_data['aircraft']}",
-            color=0x0066CC
-        )
-        embed.add_field(name="👤 Who is flying?", value="Please select who this booking is for:", inline=False)
-        embed.set_footer(text="Air Korea PTFS")
+        if pages:
+            self.add_item(FlightSelectMenu(user_id, pages[self.page]))
         
-        await interaction.response.edit_message(embed=embed, view=view)
+        if self.page_count > 1:
+            self.add_item(FlightPageButton(user_id, max(self.page - 1, 0), within_hours, route,
+                                           label="Previous", emoji="◀️", disabled=self.page == 0))
+            self.add_item(Button(label=f"Page {self.page + 1}/{self.page_count}", style=discord.ButtonStyle.secondary,
+                                 disabled=True, custom_id=f"ak:page:{self.page}"))
+            self.add_item(FlightPageButton(user_id, min(self.page + 1, self.page_count - 1), within_hours, route,
+                                           disabled=self.page >= self.page_count - 1))
+
+
+async def flight_selected(bot, interaction: discord.Interaction, user_id, flight_code):
+    if interaction.user.id != user_id:
+        await interaction.response.send_message("This isn't your booking!", ephemeral=True)
+        return
+    
+    flight_data = bot.flights.get(flight_code)
+    if not flight_data:
+        await interaction.response.send_message("❌ Flight not found!", ephemeral=True)
+        return
+    
+    if not bookable_code(flight_code):
+        await interaction.response.send_message(UNBOOKABLE_CODE, ephemeral=True)
+        return
+    
+    view = BookingTypeView(flight_code, user_id)
+    await interaction.response.edit_message(embed=booking_confirm_embed(flight_code, flight_data), view=view.seal())
+
+
+async def start_cabin_selection(bot, interaction: discord.Interaction, flight_code, booker_id, roblox_username, passenger_id, prompt):
+    hold_id = await bot.inventory.hold(flight_code, booking_hold_id(flight_code, booker_id, roblox_username, passenger_id))
+    if not hold_id:
+        view = WaitlistView(flight_code, booker_id, roblox_username, passenger_id)
+        await interaction.response.send_message("❌ No spots available on this flight! Pick a cabin class to join the waitlist:",
+                                                view=view.seal(), ephemeral=True)
+        return
+    
+    view = CabinClassView(flight_code, booker_id, roblox_username, passenger_id)
+    await interaction.response.send_message(prompt, view=view.seal(), ephemeral=True)
 
 
 class RobloxUsernameModal(discord.ui.Modal, title="Enter Your Roblox Username"):
@@ -154,24 +2840,26 @@ class RobloxUsernameModal(discord.ui.Modal, title="Enter Your Roblox Username"):
         max_length=20
     )
     
-    def __init__(self, flight_code, booker_id, passenger_id):
+    def __init__(self, bot, flight_code, booker_id, passenger_id):
         super().__init__()
+        self.bot = bot
         self.flight_code = flight_code
         self.booker_id = booker_id
         self.passenger_id = passenger_id
     
+    @metrics.timed("username_modal")
     async def on_submit(self, interaction: discord.Interaction):
         roblox_username = self.username.value.strip()
         
-        if not await check_roblox_username(roblox_username):
+        if not await check_roblox_username(self.bot, roblox_username):
             await interaction.response.send_message(
                 "Wrong ROblox Username.",
                 ephemeral=True
             )
             return
         
-        view = CabinClassView(self.flight_code, self.booker_id, roblox_username, self.passenger_id)
-        await interaction.response.send_message("Please select your cabin class:", view=view, ephemeral=True)
+        await start_cabin_selection(self.bot, interaction, self.flight_code, self.booker_id, roblox_username,
+                                    self.passenger_id, "Please select your cabin class:")
 
 
 class SomeoneElseModal(discord.ui.Modal, title="Book for Someone Else"):
@@ -191,11 +2879,13 @@ class SomeoneElseModal(discord.ui.Modal, title="Book for Someone Else"):
         max_length=20
     )
     
-    def __init__(self, flight_code, booker_id):
+    def __init__(self, bot, flight_code, booker_id):
         super().__init__()
+        self.bot = bot
         self.flight_code = flight_code
         self.booker_id = booker_id
     
+    @metrics.timed("someone_else_modal")
     async def on_submit(self, interaction: discord.Interaction):
         try:
             passenger_id = int(self.discord_id.value.strip())
@@ -205,136 +2895,373 @@ class SomeoneElseModal(discord.ui.Modal, title="Book for Someone Else"):
         
         roblox_username = self.username.value.strip()
         
-        if not await check_roblox_username(roblox_username):
+        if not await check_roblox_username(self.bot, roblox_username):
             await interaction.response.send_message("❌ Invalid Roblox username. Please start the booking process again.", ephemeral=True)
             return
         
-        view = CabinClassView(self.flight_code, self.booker_id, roblox_username, passenger_id)
-        await interaction.response.send_message("Please select the cabin class:", view=view, ephemeral=True)
+        await start_cabin_selection(self.bot, interaction, self.flight_code, self.booker_id, roblox_username,
+                                    passenger_id, "Please select the cabin class:")
 
 
-class BookingTypeView(View):
-    def __init__(self, flight_code, user_id):
-        super().__init__(timeout=300)
-        self.flight_code = flight_code
+class BookingTypeButton(LoadedItem, discord.ui.DynamicItem[Button], template=r'ak:bt:(?P<kind>[ms]):(?P<user>\d+):(?P<flight>[^:]+)'):
+    def __init__(self, kind, user_id, flight_code):
+        if kind == "m":
+            button = Button(label="Myself", style=discord.ButtonStyle.primary, emoji="👤",
+                            custom_id=checked_custom_id(f"ak:bt:m:{user_id}:{flight_key(flight_code)}"))
+        else:
+            button = Button(label="Someone Else", style=discord.ButtonStyle.secondary, emoji="👥",
+                            custom_id=checked_custom_id(f"ak:bt:s:{user_id}:{flight_key(flight_code)}"))
+        super().__init__(button)
+        self.kind = kind
         self.user_id = user_id
+        self.flight_code = flight_code
     
-    @discord.ui.button(label="Myself", style=discord.ButtonStyle.primary, emoji="👤")
-    async def myself_button(self, interaction: discord.Interaction, button: Button):
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(match['kind'], int(match['user']), unquote(match['flight']))
+    
+    @metrics.timed("booking_type")
+    async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("This isn't your booking!", ephemeral=True)
             return
         
-        modal = RobloxUsernameModal(self.flight_code, self.user_id, None)
+        if self.kind == "m":
+            modal = RobloxUsernameModal(interaction.client, self.flight_code, self.user_id, None)
+        else:
+            modal = SomeoneElseModal(interaction.client, self.flight_code, self.user_id)
         await interaction.response.send_modal(modal)
+
+
+class BookingTypeView(StatelessView):
+    def __init__(self, flight_code, user_id):
+        super().__init__()
+        self.add_item(BookingTypeButton("m", user_id, flight_code))
+        self.add_item(BookingTypeButton("s", user_id, flight_code))
+
+
+class CabinButton(LoadedItem, discord.ui.DynamicItem[Button], template=r'ak:cb:(?P<cabin>\d):(?P<booker>\d+):(?P<passenger>\d+):(?P<flight>[^:]+):(?P<username>\w+)'):
+    def __init__(self, cabin, flight_code, booker_id, roblox_username, passenger_id):
+        class_name, emoji = CABIN_CLASSES[cabin]
+        super().__init__(Button(
+            label=class_name,
+            emoji=emoji,
+            style=discord.ButtonStyle.primary,
+            custom_id=checked_custom_id(f"ak:cb:{cabin}:{booker_id}:{passenger_id or 0}:{flight_key(flight_code)}:{roblox_username}")
+        ))
+        self.cabin_class = class_name
+        self.flight_code = flight_code
+        self.booker_id = booker_id
+        self.roblox_username = roblox_username
+        self.passenger_id = passenger_id
     
-    @discord.ui.button(label="Someone Else", style=discord.ButtonStyle.secondary, emoji="👥")
-    async def someone_else_button(self, interaction: discord.Interaction, button: Button):
-        if interaction.user.id != self.user_id:
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(int(match['cabin']), unquote(match['flight']), int(match['booker']), match['username'], int(match['passenger']) or None)
+    
+    @metrics.timed("cabin_class")
+    async def callback(self, interaction: discord.Interaction):
+        if interaction.user.id != self.booker_id:
             await interaction.response.send_message("This isn't your booking!", ephemeral=True)
             return
         
-        modal = SomeoneElseModal(self.flight_code, self.user_id)
-        await interaction.response.send_modal(modal)
+        await complete_booking(interaction.client, interaction, self.flight_code, self.booker_id,
+                               self.roblox_username, self.passenger_id, self.cabin_class)
 
 
-class CabinClassView(View):
+class CabinClassView(StatelessView):
     def __init__(self, flight_code, booker_id, roblox_username, passenger_id):
-        super().__init__(timeout=300)
+        super().__init__()
+        for cabin in range(len(CABIN_CLASSES)):
+            self.add_item(CabinButton(cabin, flight_code, booker_id, roblox_username, passenger_id))
+
+
+class WaitlistButton(LoadedItem, discord.ui.DynamicItem[Button], template=r'ak:wl:(?P<cabin>\d):(?P<booker>\d+):(?P<passenger>\d+):(?P<flight>[^:]+):(?P<username>\w+)'):
+    def __init__(self, cabin, flight_code, booker_id, roblox_username, passenger_id):
+        class_name, emoji = CABIN_CLASSES[cabin]
+        super().__init__(Button(
+            label=f"Waitlist - {class_name}",
+            emoji=emoji,
+            style=discord.ButtonStyle.secondary,
+            custom_id=checked_custom_id(f"ak:wl:{cabin}:{booker_id}:{passenger_id or 0}:{flight_key(flight_code)}:{roblox_username}")
+        ))
+        self.cabin_class = class_name
         self.flight_code = flight_code
         self.booker_id = booker_id
         self.roblox_username = roblox_username
         self.passenger_id = passenger_id
-        
-        classes = [("Economy", "💺"), ("Premium Economy", "🪑"), ("Business", "🛋️"), ("First Class", "👑")]
-        
-        for class_name, emoji in classes:
-            button = Button(label=class_name, emoji=emoji, style=discord.ButtonStyle.primary)
-            button.callback = self.create_callback(class_name)
-            self.add_item(button)
     
-    def create_callback(self, cabin_class):
-        async def callback(interaction: discord.Interaction):
-            if interaction.user.id != self.booker_id:
-                await interaction.response.send_message("This isn't your booking!", ephemeral=True)
-                return
-            
-            await self.complete_booking(interaction, cabin_class)
-        return callback
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(int(match['cabin']), unquote(match['flight']), int(match['booker']), match['username'], int(match['passenger']) or None)
     
-    async def complete_booking(self, interaction: discord.Interaction, cabin_class: str):
-        flight_data = client.flights.get(self.flight_code)
+    @metrics.timed("waitlist")
+    async def callback(self, interaction: discord.Interaction):
+        if interaction.user.id != self.booker_id:
+            await interaction.response.send_message("This isn't your booking!", ephemeral=True)
+            return
         
-        if not flight_data:
+        bot = interaction.client
+        if self.flight_code not in bot.flights:
             await interaction.response.send_message("❌ Flight not found!", ephemeral=True)
             return
         
-        if flight_data['spots_left'] <= 0:
-            await interaction.response.send_message("❌ No spots available on this flight!", ephemeral=True)
+        if bot.index.passenger_booked(self.flight_code, self.roblox_username):
+            await interaction.response.send_message(f"✅ `{self.roblox_username}` is already booked on this flight!", ephemeral=True)
             return
         
-        client.flights[self.flight_code]['spots_left'] -= 1
-        client.save_flights()
-        
-        booking_code = client.generate_booking_code()
-        
         passenger_discord_id = self.passenger_id if self.passenger_id else self.booker_id
-        client.add_booking(self.flight_code, booking_code, self.roblox_username, passenger_discord_id, cabin_class)
-        
-        
-        unix_time = None
-        try:
-            departure_dt = datetime.strptime(flight_data['departure'], "%Y-%m-%d %H:%M")
-            unix_time = int(departure_dt.timestamp())
-            time_display = f"<t:{unix_time}:F>"
-            relative_time = f"<t:{unix_time}:R>"
-        except Exception as e:
-            print(f"Error parsing departure time: {e}")
-            time_display = flight_data['departure']
-            relative_time = "N/A"
-        
-        embed = discord.Embed(
-            title="🎫 Booking Confirmation",
-            description=f"Thank you for choosing **Air Korea!** Your flight has been successfully booked.\n\n**Flight {self.flight_code}** is ready for boarding!",
-            color=0x0066CC,
-            timestamp=datetime.utcnow()
+        position = bot.waitlist.join(self.flight_code, self.booker_id, self.roblox_username, passenger_discord_id, self.cabin_class)
+        await interaction.response.send_message(
+            f"⏳ `{self.roblox_username}` is #{position} on the waitlist for **Flight {self.flight_code}** ({self.cabin_class}). "
+            f"We'll DM you the booking code if a seat opens up.",
+            ephemeral=True
         )
         
-        embed.add_field(name="✈️ Flight Number", value=f"`{self.flight_code}`", inline=True)
-        embed.add_field(name="🛫 Route", value=flight_data['route'], inline=True)
-        embed.add_field(name="🛩️ Aircraft", value=flight_data['aircraft'], inline=True)
-        embed.add_field(name="💳 Booking Code", value=f"```{booking_code}```", inline=False)
-        embed.add_field(name="👤 Passenger (Roblox)", value=f"`{self.roblox_username}`", inline=True)
-        embed.add_field(name="💺 Cabin Class", value=cabin_class, inline=True)
-        embed.add_field(name="🌍 Timezone", value=flight_data.get('timezone', 'UTC'), inline=True)
-        embed.add_field(name="🕐 Departure Time", value=time_display, inline=True)
-        embed.add_field(name="⏱️ Boarding In", value=relative_time, inline=True)
-        embed.add_field(name="📅 Booked On", value=f"<t:{int(datetime.utcnow().timestamp())}:D>", inline=True)
-        
-        embed.set_footer(text="Air Korea PTFS • Please arrive 30 minutes before departure")
+        # a seat may have freed up while the button was on screen
+        await bot.waitlist.promote(self.flight_code)
+
+
+class WaitlistView(StatelessView):
+    def __init__(self, flight_code, booker_id, roblox_username, passenger_id, cabins=None):
+        super().__init__()
+        for cabin in cabins if cabins is not None else range(len(CABIN_CLASSES)):
+            self.add_item(WaitlistButton(cabin, flight_code, booker_id, roblox_username, passenger_id))
+
+
+async def complete_booking(bot, interaction: discord.Interaction, flight_code, booker_id, roblox_username, passenger_id, cabin_class):
+    flight_data = bot.flights.get(flight_code)
+    
+    if not flight_data:
+        await interaction.response.send_message("❌ Flight not found!", ephemeral=True)
+        return
+    
+    passenger_discord_id = passenger_id if passenger_id else booker_id
+    booking_code, created = await bot.inventory.commit(
+        booking_hold_id(flight_code, booker_id, roblox_username, passenger_id),
+        flight_code, roblox_username, passenger_discord_id, cabin_class
+    )
+    
+    if not booking_code:
+        view = WaitlistView(flight_code, booker_id, roblox_username, passenger_id, [CabinClass.parse(cabin_class)])
+        await interaction.response.send_message("❌ No spots available on this flight! You can join the waitlist instead:",
+                                                view=view.seal(), ephemeral=True)
+        return
+    
+    # don't confirm a booking that isn't on disk yet, concurrent bookings share one flush
+    await bot.store.barrier()
+    
+    if not created:
+        await interaction.response.send_message(f"✅ Already booked! Your booking code is `{booking_code}`.", ephemeral=True)
+        return
+    
+    unix_time = departure_timestamp(flight_data['departure'])
+    if unix_time is not None:
+        time_display = f"<t:{unix_time}:F>"
+        relative_time = f"<t:{unix_time}:R>"
+    else:
+        time_display = flight_data['departure']
+        relative_time = "N/A"
+    
+    embed = discord.Embed(
+        title="🎫 Booking Confirmation",
+        description=f"Thank you for choosing **Air Korea!** Your flight has been successfully booked.\n\n**Flight {flight_code}** is ready for boarding!",
+        color=0x0066CC,
+        timestamp=datetime.utcnow()
+    )
+    
+    embed.add_field(name="✈️ Flight Number", value=f"`{flight_code}`", inline=True)
+    embed.add_field(name="🛫 Route", value=flight_data['route'], inline=True)
+    embed.add_field(name="🛩️ Aircraft", value=flight_data['aircraft'], inline=True)
+    embed.add_field(name="💳 Booking Code", value=f"```{booking_code}```", inline=False)
+    embed.add_field(name="👤 Passenger (Roblox)", value=f"`{roblox_username}`", inline=True)
+    embed.add_field(name="💺 Cabin Class", value=cabin_class, inline=True)
+    embed.add_field(name="🌍 Timezone", value=flight_data.get('timezone', 'UTC'), inline=True)
+    embed.add_field(name="🕐 Departure Time", value=time_display, inline=True)
+    embed.add_field(name="⏱️ Boarding In", value=relative_time, inline=True)
+    embed.add_field(name="📅 Booked On", value=f"<t:{int(datetime.utcnow().timestamp())}:D>", inline=True)
+    
+    embed.set_footer(text="Air Korea PTFS • Please arrive 30 minutes before departure")
+    
+    # answer the interaction first, the DM goes out from the queue afterwards
+    if passenger_id:
+        await interaction.response.send_message(f"✅ Booking confirmed! Your booking code is `{booking_code}`. Confirmation is on its way to <@{passenger_id}>'s DMs.", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"✅ Booking confirmed! Your booking code is `{booking_code}`. Check your DMs for confirmation details.", ephemeral=True)
+    
+    async def on_dead(reason):
+        if reason == "dms_closed":
+            await interaction.followup.send("⚠️ Couldn't send the confirmation DM. Please enable DMs from server members.", ephemeral=True)
+        else:
+            await interaction.followup.send("⚠️ Couldn't send the confirmation DM. Please check your DM settings.", ephemeral=True)
+    
+    await bot.dms.put(passenger_discord_id, on_dead=on_dead, embed=embed)
+
+
+class EmbedPager(View):
+    def __init__(self, embeds, user_id, page=0):
+        super().__init__(timeout=300)
+        self.embeds = embeds
+        self.user_id = user_id
+        self.page = page
+        self.update_buttons()
+    
+    def update_buttons(self):
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= len(self.embeds) - 1
+    
+    async def show(self, interaction: discord.Interaction, page):
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("This isn't yours!", ephemeral=True)
+            return
         
-        try:
-            if self.passenger_id:
-                passenger = await client.fetch_user(self.passenger_id)
-                await passenger.send(embed=embed)
-                await interaction.response.send_message(f"✅ Booking confirmed! Confirmation sent to <@{self.passenger_id}>'s DMs.", ephemeral=True)
-            else:
-                user = await client.fetch_user(self.booker_id)
-                await user.send(embed=embed)
-                await interaction.response.send_message("✅ Booking confirmed! Check your DMs for confirmation details.", ephemeral=True)
-        except discord.Forbidden:
-            await interaction.response.send_message("✅ Booking confirmed but couldn't send DM. Please enable DMs from server members.", ephemeral=True)
-        except Exception as e:
-            print(f"Error sending DM: {e}")
-            await interaction.response.send_message(f"✅ Booking confirmed but couldn't send DM. Please check your DM settings.", ephemeral=True)
+        self.page = page
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.embeds[self.page], view=self)
+    
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary, emoji="◀️")
+    @metrics.timed("pager")
+    async def prev_button(self, interaction: discord.Interaction, button: Button):
+        await self.show(interaction, self.page - 1)
+    
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary, emoji="▶️")
+    @metrics.timed("pager")
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        await self.show(interaction, self.page + 1)
+
+
+async def send_pages(interaction: discord.Interaction, embeds):
+    if len(embeds) > 1:
+        await interaction.response.send_message(embed=embeds[0], view=EmbedPager(embeds, interaction.user.id), ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embeds[0], ephemeral=True)
+
+
+def group_by_cabin(passengers):
+    # one pass over the booking list
+    emojis = dict(CABIN_CLASSES)
+    cabins = {}
+    for p in passengers:
+        cabin = cabin_label(p.cabin_class)
+        cabins.setdefault(cabin, []).append(f"{emojis.get(cabin, '🎫')} `{p.roblox_username}` - {p.booking_code}")
+    return cabins
+
+
+def paginate_fields(sections, new_embed, footer=None):
+    # sections is [(field name, lines)], fields are split at 1024 chars and
+    # embeds at 25 fields / ~6000 chars, so any number of lines fits.
+    # the footer gets a page number once there's more than one embed
+    embeds = [new_embed()]
+    size = 0
+    
+    def add_field(name, value):
+        nonlocal size
+        embed = embeds[-1]
+        if len(embed.fields) >= EMBED_MAX_FIELDS or size + len(name) + len(value) > EMBED_TOTAL_LIMIT:
+            embed = new_embed()
+            embeds.append(embed)
+            size = 0
+        embed.add_field(name=name, value=value, inline=False)
+        size += len(name) + len(value)
+    
+    for name, lines in sections:
+        chunk, chunk_len, field_name = [], 0, name
+        for line in lines:
+            if chunk and chunk_len + len(line) + 1 > EMBED_FIELD_LIMIT:
+                add_field(field_name, "\n".join(chunk))
+                chunk, chunk_len, field_name = [], 0, f"{name} (cont.)"
+            chunk.append(line[:EMBED_FIELD_LIMIT])
+            chunk_len += len(line) + 1
+        if chunk:
+            add_field(field_name, "\n".join(chunk))
+    
+    if footer is not None:
+        for page, embed in enumerate(embeds, 1):
+            embed.set_footer(text=footer if len(embeds) == 1 else f"{footer} • Page {page}/{len(embeds)}")
+    return embeds
+
+
+def manifest_embeds(flight_code, flight_data, passengers):
+    cabins = group_by_cabin(passengers)
+    known = [cabin for cabin, _ in MANIFEST_SECTIONS]
+    sections = [(title, cabins[cabin]) for cabin, title in MANIFEST_SECTIONS if cabin in cabins]
+    sections += [(cabin, lines) for cabin, lines in cabins.items() if cabin not in known]
+    
+    def new_embed():
+        return discord.Embed(
+            title=f"👥 Passenger Manifest - Flight {flight_code}",
+            description=f"**Route:** {flight_data['route']}\n**Aircraft:** {flight_data['aircraft']}\n**Total Passengers:** {len(passengers)}",
+            color=0x0066CC
+        )
+    
+    embeds = paginate_fields(sections, new_embed, f"Air Korea PTFS • {len(passengers)} Total Passengers")
+    return embeds
+
+
+MANIFEST_COLUMNS = ["booking_code", "roblox_username", "discord_id", "cabin_class", "booked_at"]
+
+
+def manifest_file(flight_code, passengers, file_format):
+    # rows are streamed straight into the buffer, nothing is joined up front
+    buffer = io.BytesIO()
+    writer = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+    
+    if file_format == "csv":
+        rows = csv.writer(writer)
+        rows.writerow(MANIFEST_COLUMNS)
+        for p in passengers:
+            row = p.to_dict()
+            rows.writerow([row[column] for column in MANIFEST_COLUMNS])
+    else:
+        for p in passengers:
+            writer.write(json.dumps(p.to_dict()))
+            writer.write("\n")
+    
+    writer.flush()
+    writer.detach()
+    buffer.seek(0)
+    return discord.File(buffer, filename=f"{flight_code}_manifest.{file_format}")
 
 
 @client.tree.command(name="bookflight", description="Book a flight with Air Korea")
-async def book_flight(interaction: discord.Interaction):
-    if not client.flights:
+@app_commands.describe(
+    flight="Jump straight to a flight code (e.g., AK5453)",
+    route="Only show flights whose route contains this (e.g., HEATHROW)",
+    within_hours="Only show flights departing within this many hours"
+)
+@metrics.timed("bookflight")
+async def book_flight(interaction: discord.Interaction, flight: Optional[str] = None,
+    route: Optional[str] = None, within_hours: Optional[int] = None):
+    bot = interaction.client
+    if not bot.flights:
         await interaction.response.send_message(" No flights available at the moment.", ephemeral=True)
         return
     
+    if flight:
+        flight_code = flight if flight in bot.flights else flight.upper()
+        flight_data = bot.flights.get(flight_code)
+        if not flight_data:
+            await interaction.response.send_message(f"❌ Flight **{flight}** not found!", ephemeral=True)
+            return
+        
+        if not bookable_code(flight_code):
+            await interaction.response.send_message(UNBOOKABLE_CODE, ephemeral=True)
+            return
+        
+        view = BookingTypeView(flight_code, interaction.user.id)
+        await interaction.response.send_message(embed=booking_confirm_embed(flight_code, flight_data), view=view.seal(), ephemeral=True)
+        return
+    
+    # the filter rides along in the page buttons' custom_id, it has to fit whole
+    if route and len(route) > ROUTE_FILTER_LIMIT:
+        await interaction.response.send_message(f"❌ Route filter is too long, use at most {ROUTE_FILTER_LIMIT} characters.", ephemeral=True)
+        return
+    
+    view = FlightSelectView(bot, interaction.user.id, route, within_hours)
+    if not view.page_count:
+        await interaction.response.send_message("❌ No upcoming flights match your search.", ephemeral=True)
+        return
+    
     embed = discord.Embed(
         title="✈️ Air Korea Flight Booking",
         description="**Welcome aboard!** Select your preferred flight from the options below to begin your journey.\n\n🌏 Connecting Korea to the World",
@@ -356,8 +3283,116 @@ async def book_flight(interaction: discord.Interaction):
     embed.set_footer(text="Air Korea PTFS • Professional Flight Simulator")
     embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
     
-    view = FlightSelectView(client.flights, interaction.user.id)
-    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+    await interaction.response.send_message(embed=embed, view=view.seal(), ephemeral=True)
+
+
+@book_flight.autocomplete('flight')
+async def flight_autocomplete(interaction: discord.Interaction, current: str):
+    bot = interaction.client
+    choices = []
+    for flight_code in bot.flight_index.search(current):
+        flight_data = bot.flights[flight_code]
+        choices.append(app_commands.Choice(name=f"{flight_code} - {flight_data['route']}"[:100], value=flight_code))
+    return choices
+
+
+def is_admin(user):
+    # later was changed to role id check 
+    return any(role.name == ADMIN_ROLE_NAME for role in getattr(user, 'roles', []))
+
+
+@client.tree.command(name="cancel", description="Cancel one of your bookings")
+@app_commands.describe(booking_code="Booking code from your confirmation (e.g., AK12345-ABCDEF)")
+@metrics.timed("cancel")
+async def cancel_booking(interaction: discord.Interaction, booking_code: str):
+    bot = interaction.client
+    booking_code = booking_code.strip().upper()
+    entry = bot.index.get(booking_code)
+    if entry is None:
+        await interaction.response.send_message(f"❌ Booking **{booking_code}** not found!", ephemeral=True)
+        return
+    
+    flight_code, booking = entry
+    if booking.discord_id != interaction.user.id and not is_admin(interaction.user):
+        await interaction.response.send_message("❌ You can only cancel your own bookings!", ephemeral=True)
+        return
+    
+    if flight_code not in bot.flights:
+        await interaction.response.send_message(f"❌ **Flight {flight_code}** has already departed.", ephemeral=True)
+        return
+    
+    if not await bot.inventory.cancel(flight_code, booking_code):
+        await interaction.response.send_message(f"❌ Booking **{booking_code}** was already cancelled.", ephemeral=True)
+        return
+    
+    await bot.store.barrier()
+    await interaction.response.send_message(
+        f"✅ Booking **{booking_code}** for `{booking.roblox_username}` on **Flight {flight_code}** has been cancelled.",
+        ephemeral=True
+    )
+    
+    # the freed seat goes to whoever is first on the waitlist
+    await bot.waitlist.promote(flight_code)
+
+
+@cancel_booking.autocomplete('booking_code')
+async def booking_code_autocomplete(interaction: discord.Interaction, current: str):
+    bot = interaction.client
+    choices = []
+    for booking_code, (flight_code, booking) in bot.index.by_discord.get(interaction.user.id, {}).items():
+        if current.upper() in booking_code:
+            choices.append(app_commands.Choice(name=f"{booking_code} - {flight_code} - {booking.roblox_username}"[:100], value=booking_code))
+    return choices[:25]
+
+
+@client.tree.command(name="mybookings", description="Your bookings and waitlist places")
+@metrics.timed("mybookings")
+async def my_bookings(interaction: discord.Interaction):
+    bot = interaction.client
+    bookings = bot.index.for_user(interaction.user.id)
+    waiting = [(code, entry) for code, entry in bot.store.waitlist_for_user(interaction.user.id) if code in bot.flights]
+    
+    if not bookings and not waiting:
+        await interaction.response.send_message("You have no bookings. Use `/bookflight` to book one!", ephemeral=True)
+        return
+    
+    def departs(flight_code):
+        flight_data = bot.flights.get(flight_code)
+        return departure_timestamp(flight_data['departure']) if flight_data else None
+    
+    emojis = dict(CABIN_CLASSES)
+    upcoming, past = [], []
+    for flight_code, booking in sorted(bookings, key=lambda b: (departs(b[0]) or 0, b[0])):
+        cabin = cabin_label(booking.cabin_class)
+        flight_data = bot.flights.get(flight_code)
+        if flight_data is None:
+            past.append(f"{emojis.get(cabin, '🎫')} **{flight_code}** - `{booking.roblox_username}` - {booking.booking_code}")
+            continue
+        ts = departs(flight_code)
+        when = f"<t:{ts}:f> (<t:{ts}:R>)" if ts else flight_data['departure']
+        upcoming.append(f"{emojis.get(cabin, '🎫')} **{flight_code}** {flight_data['route']} - {when}\n"
+                        f"`{booking.roblox_username}` - {cabin} - `{booking.booking_code}`")
+    
+    waitlist_lines = []
+    for flight_code, entry in waiting:
+        position = [e['id'] for e in bot.store.waitlist(flight_code)].index(entry['id']) + 1
+        waitlist_lines.append(f"⏳ **{flight_code}** {bot.flights[flight_code]['route']} - "
+                              f"`{entry['roblox_username']}` - {entry['cabin_class']} - #{position} in line")
+    
+    sections = [(name, lines) for name, lines in (("🎫 Bookings", upcoming), ("🛬 Past Flights", past), ("⏳ Waitlist", waitlist_lines)) if lines]
+    
+    def new_embed():
+        embed = discord.Embed(
+            title="🎫 My Bookings",
+            description=f"**{len(bookings)}** bookings, **{len(waiting)}** on the waitlist",
+            color=0x0066CC
+        )
+        embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
+        return embed
+    
+    embeds = paginate_fields(sections, new_embed, "Air Korea PTFS • /cancel <code> to cancel a booking")
+    
+    await send_pages(interaction, embeds)
 
 
 @client.tree.command(name="adminpanel", description="Admin panel to manage flights")
@@ -368,14 +3403,16 @@ async def book_flight(interaction: discord.Interaction):
     aircraft="Aircraft type (e.g., Airbus A320-271N)",
     spots="Number of available spots",
     departure="Departure date and time (UTC format: YYYY-MM-DD HH:MM)",
-    timezone="Timezone (e.g., Europe/London)"
+    timezone="Timezone (e.g., Europe/London)",
+    export="Passenger manifest as a file instead of embeds (csv or jsonl)"
 )
+@metrics.timed("adminpanel")
 async def admin_panel(interaction: discord.Interaction, action: str, flight_code: Optional[str] = None,
     route: Optional[str] = None, aircraft: Optional[str] = None, spots: Optional[int] = None,
-    departure: Optional[str] = None, timezone: Optional[str] = "Europe/London"):
+    departure: Optional[str] = None, timezone: Optional[str] = "Europe/London", export: Optional[str] = None):
+    bot = interaction.client
     
-    # later was changed to role id check 
-    if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         await interaction.response.send_message("❌ You don't have permission to use this command!", ephemeral=True)
         return
     
@@ -384,14 +3421,21 @@ async def admin_panel(interaction: discord.Interaction, action: str, flight_code
             await interaction.response.send_message("❌ Please provide all required fields: flight_code, route, aircraft, spots, departure", ephemeral=True)
             return
         
-        client.flights[flight_code] = {
-            "route": route,
-            "aircraft": aircraft,
-            "spots_left": spots,
-            "departure": departure,
-            "timezone": timezone
-        }
-        client.save_flights()
+        try:
+            flight_code, flight_data = parse_flight_row({
+                "flight_code": flight_code,
+                "route": route,
+                "aircraft": aircraft,
+                "spots": spots,
+                "departure": departure,
+                "timezone": timezone
+            })
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
+        
+        bot.flights[flight_code] = flight_data
+        bot.save_flight(flight_code)
         
         await interaction.response.send_message(
             f"✅ Flight **{flight_code}** added successfully!\n"
@@ -407,112 +3451,349 @@ async def admin_panel(interaction: discord.Interaction, action: str, flight_code
             await interaction.response.send_message("❌ Please provide a flight_code to delete", ephemeral=True)
             return
         
-        if flight_code in client.flights:
-            del client.flights[flight_code]
-            client.save_flights()
-            await interaction.response.send_message(f"✅ Flight **{flight_code}** deleted successfully!", ephemeral=True)
+        if flight_code in bot.flights:
+            flight_data = bot.flights[flight_code]
+            passengers, waiting = bot.delete_flight(flight_code)
+            await interaction.response.send_message(
+                f"✅ Flight **{flight_code}** deleted successfully! "
+                f"{len(passengers)} bookings cancelled, {len(waiting)} removed from the waitlist.",
+                ephemeral=True
+            )
+            await bot.waitlist.notify_cancelled(flight_code, flight_data, passengers, waiting)
         else:
             await interaction.response.send_message(f"❌ Flight **{flight_code}** not found!", ephemeral=True)
     
     elif action == "list":
-        if not client.flights:
+        if not bot.flights:
             await interaction.response.send_message("No flights available.", ephemeral=True)
             return
         
-        embed = discord.Embed(
-            title="✈️ Air Korea Fleet Status",
-            description="Current active flights and availability",
-            color=0x0066CC
-        )
-        
-        for code, data in client.flights.items():
-            passengers = len(client.bookings.get(code, []))
-            total_seats = passengers + data['spots_left']
+        sections = []
+        for code, data in bot.flights.items():
+            passengers = bot.index.passenger_count(code)
+            total_seats = bot.flight_capacity(code)
             
-            embed.add_field(
-                name=f"✈️ {code}",
-                value=f"**Route:** {data['route']}\n"
-                      f"**Aircraft:** {data['aircraft']}\n"
-                      f"**Occupancy:** {passengers}/{total_seats} seats booked\n"
-                      f"**Available:** {data['spots_left']} spots\n"
-                      f"**Departure:** {data['departure']}",
-                inline=False
+            sections.append((f"✈️ {code}", [
+                f"**Route:** {data['route']}\n"
+                f"**Aircraft:** {data['aircraft']}\n"
+                f"**Occupancy:** {passengers}/{total_seats} seats booked\n"
+                f"**Available:** {data['spots_left']} spots\n"
+                f"**Departure:** {data['departure']}"
+            ]))
+        
+        def new_embed():
+            return discord.Embed(
+                title="✈️ Air Korea Fleet Status",
+                description="Current active flights and availability",
+                color=0x0066CC
             )
         
-        embed.set_footer(text="Air Korea PTFS • Admin Panel")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        embeds = paginate_fields(sections, new_embed, "Air Korea PTFS • Admin Panel")
+        
+        await send_pages(interaction, embeds)
     
     elif action == "passengers":
         if not flight_code:
             await interaction.response.send_message("❌ Please provide a flight_code to view passengers", ephemeral=True)
             return
         
-        if flight_code not in client.flights:
+        if flight_code not in bot.flights:
             await interaction.response.send_message(f"❌ Flight **{flight_code}** not found!", ephemeral=True)
             return
         
-        passengers = client.bookings.get(flight_code, [])
+        passengers = bot.bookings.get(flight_code, [])
         
         if not passengers:
             await interaction.response.send_message(f"✈️ Flight **{flight_code}** has no passengers yet.", ephemeral=True)
             return
         
-        flight_data = client.flights[flight_code]
-        embed = discord.Embed(
-            title=f"👥 Passenger Manifest - Flight {flight_code}",
-            description=f"**Route:** {flight_data['route']}\n**Aircraft:** {flight_data['aircraft']}\n**Total Passengers:** {len(passengers)}",
-            color=0x0066CC
-        )
+        if export:
+            if export not in ("csv", "jsonl"):
+                await interaction.response.send_message("❌ Invalid export format! Use: **csv** or **jsonl**", ephemeral=True)
+                return
+            
+            file = manifest_file(flight_code, passengers, export)
+            await interaction.response.send_message(f"📄 Manifest for **{flight_code}** ({len(passengers)} passengers)", file=file, ephemeral=True)
+            return
         
-        # cabin class 
-        economy = [p for p in passengers if p['cabin_class'] == 'Economy']
-        premium = [p for p in passengers if p['cabin_class'] == 'Premium Economy']
-        business = [p for p in passengers if p['cabin_class'] == 'Business']
-        first = [p for p in passengers if p['cabin_class'] == 'First Class']
+        await send_pages(interaction, manifest_embeds(flight_code, bot.flights[flight_code], passengers))
+    
+    elif action == "recurring":
+        templates = bot.templates.all()
+        if not templates:
+            await interaction.response.send_message("No recurring flights. Add some with `/importflights`.", ephemeral=True)
+            return
         
-        if first:
-            first_list = "\n".join([f"👑 `{p['roblox_username']}` - {p['booking_code']}" for p in first])
-            embed.add_field(name="First Class", value=first_list, inline=False)
+        sections = []
+        for code, template in templates.items():
+            end = date.fromisoformat(template['start']) + timedelta(days=template['days'])
+            sections.append((f"🔁 {code}", [
+                f"**Route:** {template['route']}\n"
+                f"**Aircraft:** {template['aircraft']}\n"
+                f"**Schedule:** {template['repeat']} at {template['time']} {template['timezone']}\n"
+                f"**Runs:** {template['start']} until {end.isoformat()} ({template['capacity']} spots)\n"
+                f"**Next to create:** {template['next']}"
+            ]))
         
-        if business:
-            business_list = "\n".join([f"🛋️ `{p['roblox_username']}` - {p['booking_code']}" for p in business])
-            embed.add_field(name="Business Class", value=business_list, inline=False)
+        def new_embed():
+            return discord.Embed(
+                title="🔁 Recurring Flights",
+                description=f"Flights are created {TEMPLATE_HORIZON // 86400} days ahead of departure",
+                color=0x0066CC
+            )
         
-        if premium:
-            premium_list = "\n".join([f"🪑 `{p['roblox_username']}` - {p['booking_code']}" for p in premium])
-            embed.add_field(name="Premium Economy", value=premium_list, inline=False)
+        embeds = paginate_fields(sections, new_embed, "Air Korea PTFS • Admin Panel")
         
-        if economy:
-            economy_list = "\n".join([f"💺 `{p['roblox_username']}` - {p['booking_code']}" for p in economy])
-            embed.add_field(name="Economy Class", value=economy_list, inline=False)
+        await send_pages(interaction, embeds)
+    
+    elif action == "stoprecurring":
+        if not flight_code:
+            await interaction.response.send_message("❌ Please provide the flight_code of the recurring flight to stop", ephemeral=True)
+            return
         
-        embed.set_footer(text=f"Air Korea PTFS • {len(passengers)} Total Passengers")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        if bot.templates.remove(flight_code.upper()):
+            await interaction.response.send_message(
+                f"✅ Recurring flight **{flight_code.upper()}** stopped. Flights already created stay bookable.", ephemeral=True
+            )
+        else:
+            await interaction.response.send_message(f"❌ No recurring flight **{flight_code}**!", ephemeral=True)
     
     else:
-        await interaction.response.send_message("❌ Invalid action! Use: **add**, **delete**, **list**, or **passengers**", ephemeral=True)
+        await interaction.response.send_message(
+            "❌ Invalid action! Use: **add**, **delete**, **list**, **passengers**, **recurring**, or **stoprecurring**", ephemeral=True
+        )
 
 
 @admin_panel.autocomplete('action')
 async def action_autocomplete(interaction: discord.Interaction, current: str):
-    actions = ['add', 'delete', 'list', 'passengers']
+    actions = ['add', 'delete', 'list', 'passengers', 'recurring', 'stoprecurring']
     return [app_commands.Choice(name=action, value=action) for action in actions if current.lower() in action.lower()]
 
 
+@admin_panel.autocomplete('export')
+async def export_autocomplete(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=f, value=f) for f in ['csv', 'jsonl'] if current.lower() in f]
+
+
+@client.tree.command(name="importflights", description="Add many flights at once from a CSV, JSON or JSONL file")
+@app_commands.describe(file="Columns: flight_code, route, aircraft, spots, departure, timezone. Add repeat/time/start/days for recurring flights")
+@metrics.timed("importflights")
+async def import_flights(interaction: discord.Interaction, file: discord.Attachment):
+    bot = interaction.client
+    if not is_admin(interaction.user):
+        await interaction.response.send_message("❌ You don't have permission to use this command!", ephemeral=True)
+        return
+    
+    file_format = file.filename.rsplit(".", 1)[-1].lower()
+    if file_format not in ("csv", "json", "jsonl"):
+        await interaction.response.send_message("❌ Invalid file! Upload a **.csv**, **.json** or **.jsonl** file", ephemeral=True)
+        return
+    
+    if file.size > IMPORT_MAX_BYTES:
+        await interaction.response.send_message(f"❌ File is too big, the limit is {IMPORT_MAX_BYTES // 1024} KB", ephemeral=True)
+        return
+    
+    # downloading the attachment can take longer than discord waits for an answer
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    data = await file.read()
+    
+    flights, templates, errors = {}, {}, []
+    try:
+        for line, row in flight_rows(data, file_format):
+            if len(flights) + len(templates) >= IMPORT_MAX_ROWS:
+                errors.append(f"more than {IMPORT_MAX_ROWS} flights, split the file up")
+                break
+            
+            try:
+                flight_code, entry = parse_flight_row(json.loads(row) if isinstance(row, str) else row)
+                if flight_code in flights or flight_code in templates:
+                    raise ValueError(f"{flight_code} is in the file twice")
+                if 'repeat' in entry:
+                    templates[flight_code] = entry
+                elif flight_code in bot.flights:
+                    raise ValueError(f"{flight_code} already exists")
+                else:
+                    flights[flight_code] = entry
+            except ValueError as e:
+                errors.append(f"line {line}: {e}")
+                if len(errors) >= IMPORT_MAX_ERRORS:
+                    break
+    except (ValueError, csv.Error) as e:
+        errors.append(f"couldn't read the file: {e}")
+    
+    # all or nothing, a half imported schedule is harder to fix than a rejected file
+    if errors:
+        await interaction.followup.send("❌ Nothing was imported. Fix these and upload the file again:\n" +
+                                        "\n".join(f"• {e}" for e in errors)[:1900], ephemeral=True)
+        return
+    
+    if not flights and not templates:
+        await interaction.followup.send("❌ The file has no flights in it.", ephemeral=True)
+        return
+    
+    added = bot.add_flights(flights) if flights else []
+    created = bot.templates.add(templates) if templates else []
+    await bot.store.barrier()
+    
+    message = f"✅ Imported **{len(added)}** flights"
+    if len(added) < len(flights):
+        message += f" ({len(flights) - len(added)} skipped, they were created elsewhere in the meantime)"
+    if templates:
+        message += (f" and **{len(templates)}** recurring flights. {len(created)} departures created so far, "
+                    f"the rest are added as they come within {TEMPLATE_HORIZON // 86400} days")
+    await interaction.followup.send(message + ".", ephemeral=True)
+
+
+@client.tree.command(name="fleetstats", description="Load factor, cabin mix and booking rate across the fleet")
+@metrics.timed("fleetstats")
+async def fleet_stats(interaction: discord.Interaction):
+    bot = interaction.client
+    if not is_admin(interaction.user):
+        await interaction.response.send_message("❌ You don't have permission to use this command!", ephemeral=True)
+        return
+    
+    booked = sum(bot.index.passenger_count(code) for code in bot.flights)
+    capacity = sum(bot.flight_capacity(code) for code in bot.flights)
+    load_factor = booked / capacity * 100 if capacity else 0
+    
+    cabins = {}
+    for code in bot.flights:
+        for cabin, count in bot.index.cabin_counts.get(code, {}).items():
+            cabins[cabin_label(cabin)] = cabins.get(cabin_label(cabin), 0) + count
+    
+    embed = discord.Embed(
+        title="📊 Air Korea Fleet Statistics",
+        description=f"**Active Flights:** {len(bot.flights)}\n"
+                    f"**Seats Booked:** {booked}/{capacity}\n"
+                    f"**Load Factor:** {load_factor:.1f}%",
+        color=0x0066CC
+    )
+    
+    emojis = dict(CABIN_CLASSES)
+    cabin_mix = "\n".join(
+        f"{emojis.get(cabin, '🎫')} {cabin}: {count} ({count / booked * 100:.1f}%)"
+        for cabin, count in sorted(cabins.items(), key=lambda item: -item[1])
+    )
+    embed.add_field(name="💺 Cabin Mix", value=cabin_mix or "No bookings yet", inline=False)
+    
+    rates = []
+    for label, hours in [("Last hour", 1), ("Last 6 hours", 6), ("Last 24 hours", 24)]:
+        count = bot.stats.count(hours * 3600)
+        rates.append(f"**{label}:** {count} bookings ({count / hours:.1f}/h)")
+    embed.add_field(name="📈 Bookings", value="\n".join(rates), inline=False)
+    
+    busiest = sorted(bot.flights, key=lambda code: -bot.index.passenger_count(code) / max(bot.flight_capacity(code), 1))[:5]
+    if busiest:
+        embed.add_field(
+            name="🔥 Fullest Flights",
+            value="\n".join(f"`{code}` {bot.index.passenger_count(code)}/{bot.flight_capacity(code)}" for code in busiest),
+            inline=False
+        )
+    
+    embed.set_footer(text="Air Korea PTFS • Admin Panel")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@client.tree.command(name="botstats", description="Command latency, interaction deadlines and event loop health")
+@metrics.timed("botstats")
+async def bot_stats(interaction: discord.Interaction):
+    bot = interaction.client
+    if not is_admin(interaction.user):
+        await interaction.response.send_message("❌ You don't have permission to use this command!", ephemeral=True)
+        return
+    
+    def ms(seconds):
+        return f"{seconds * 1000:.0f}ms"
+    
+    handlers = sorted(metrics.labelled("interaction_seconds").items(), key=lambda item: -item[1].quantile(0.99))
+    lines = []
+    for labels, histogram in handlers[:10]:
+        handler = dict(labels)['handler']
+        lines.append(f"`{handler}` {histogram.count}× p50 {ms(histogram.quantile(0.5))} p99 {ms(histogram.quantile(0.99))}")
+    
+    near = sum(v for (name, _), v in metrics.counters.items() if name == "interaction_deadline_near_total")
+    missed = sum(v for (name, _), v in metrics.counters.items() if name == "interaction_deadline_missed_total")
+    errors = sum(v for (name, _), v in metrics.counters.items() if name == "interaction_errors_total")
+    
+    embed = discord.Embed(
+        title="🩺 Air Korea Bot Health",
+        description=f"**Over {INTERACTION_DEADLINE_WARN}s:** {near}\n"
+                    f"**Missed {INTERACTION_DEADLINE}s deadline:** {missed}\n"
+                    f"**Errors:** {errors}",
+        color=0x0066CC
+    )
+    embed.add_field(name="⏱️ Slowest Handlers", value="\n".join(lines) or "No interactions yet", inline=False)
+    
+    lag = metrics.histogram("event_loop_lag_seconds")
+    embed.add_field(
+        name="🔄 Event Loop",
+        value=f"**Lag p99:** {ms(lag.quantile(0.99))}\n**Worst:** {ms(lag.max)}\n"
+              f"**Stalls:** {metrics.counter('event_loop_stalls_total')}",
+        inline=True
+    )
+    
+    writes = metrics.labelled("store_write_seconds")
+    embed.add_field(
+        name="💾 Store Writes",
+        value="\n".join(f"`{dict(labels)['op']}` p99 {ms(h.quantile(0.99))}" for labels, h in sorted(writes.items())) or "None yet",
+        inline=True
+    )
+    
+    roblox = metrics.histogram("roblox_request_seconds")
+    embed.add_field(
+        name="🌐 Roblox API",
+        value=f"**Requests:** {roblox.count}\n**p99:** {ms(roblox.quantile(0.99))}\n"
+              f"**Errors:** {metrics.counter('roblox_errors_total')}",
+        inline=True
+    )
+    
+    embed.add_field(
+        name="📥 Flight Reloads",
+        value=f"**Count:** {bot.watcher.reload_count}\n**Last:** {ms(bot.watcher.last_reload_duration)}",
+        inline=True
+    )
+    
+    dm_stats = bot.dms.stats()
+    embed.add_field(
+        name="✉️ DM Queue",
+        value=f"**Depth:** {dm_stats['depth']}\n**Delivered:** {dm_stats['delivered']}\n"
+              f"**p99:** {dm_stats['latency_p99']:.1f}s",
+        inline=True
+    )
+    
+    embed.set_footer(text="Air Korea PTFS • Admin Panel")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
 async def update_flights_task():
     await client.wait_until_ready()
-    while not client.is_closed():
-        client.flights = client.load_flights()
-        await asyncio.sleep(30)
+    await client.watcher.run()
 
 
 @client.event
 async def on_ready():
-    await client.tree.sync()
+    client.phase("gateway ready")
+    # on_ready fires again after every reconnect, the tasks must only start once
+    if client.tasks_started:
+        return
+    client.tasks_started = True
+    
+    await client.loaded.wait()
     print(f'Online {client.user}')
     print(f'Bot')
     
+    if LEADER:
+        client.loop.create_task(client.sync_commands())
     client.loop.create_task(update_flights_task())
+    client.dms.start()
+    
+    # with several processes only one of them sends reminders and edits the board
+    if LEADER:
+        client.loop.create_task(client.scheduler.run())
+        client.loop.create_task(client.waitlist.run())
+        client.loop.create_task(client.templates.run())
+        if client.board.channel_ids:
+            client.loop.create_task(client.board.run())
 
 
 
@@ -524,4 +3805,9 @@ if __name__ == "__main__":
         
         exit(1)
     
+    # every process would keep its own copy of the json files and sell the same seats
+    if STORAGE_BACKEND == "json" and SHARD_IDS:
+        print("STORAGE_BACKEND=json only works in a single process, use sqlite with SHARD_IDS")
+        exit(1)
+    
     client.run(TOKEN)